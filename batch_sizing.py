@@ -0,0 +1,64 @@
+from common import write_log
+import threading
+
+class AdaptiveBatchSize:
+    """
+    Batch size for a bulk endpoint, tuned from measured request latency, payload size and failures.
+    Grows while requests finish well under target_seconds, shrinks when they get slow,
+    and halves on timeouts, 413 or 5xx responses. Always stays within [min_size, max_size].
+    """
+    def __init__(self, store, kind, initial_size, min_size, max_size, target_seconds=20, max_payload_bytes=16 * 1024 * 1024):
+        self.store = store
+        self.kind = kind
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_payload_bytes = max_payload_bytes
+        self.size = max(min_size, min(initial_size, max_size))
+        self.lock = threading.Lock()
+
+    def clamp(self, size):
+        return int(max(self.min_size, min(size, self.max_size)))
+
+    def record_success(self, size, elapsed, payload_bytes=None):
+        """Record a successful request of size items that took elapsed seconds"""
+        with self.lock:
+            if elapsed > self.target_seconds:
+                new_size = size * self.target_seconds / elapsed
+            elif elapsed < self.target_seconds / 2 and size >= self.size:
+                new_size = size * 1.5
+            else:
+                new_size = self.size
+
+            # Keep the request body under the payload limit
+            if payload_bytes and size:
+                bytes_per_item = payload_bytes / size
+                new_size = min(new_size, self.max_payload_bytes / bytes_per_item)
+
+            self.size = self.clamp(new_size)
+
+    def record_failure(self, size, status_code=None):
+        """Record a request of size items that timed out (status_code None) or was rejected"""
+        with self.lock:
+            if status_code == 413:
+                # Payload too large, never try this size again
+                self.max_size = max(self.min_size, int(size * 0.75))
+            self.size = self.clamp(min(self.size, size) / 2)
+            write_log(f"Reducing {self.kind} batch size for {self.store} to {self.size} (status: {status_code or 'timeout'})", "yellow")
+
+    def is_retryable(self, status_code):
+        """Timeouts, 413 and 5xx responses are retried with a smaller batch"""
+        return status_code is None or status_code == 413 or status_code >= 500
+
+    def report(self):
+        write_log(f"Settled {self.kind} batch size for {self.store}: {self.size}", "cyan")
+
+# Tuned batch sizes are kept for the session, so repeated migrations start from the settled size
+batch_sizes = {}
+
+def get_batch_size(store, kind, initial_size, min_size, max_size, target_seconds=20):
+    """Get the tuned batch size for a store and bulk endpoint, creating it on first use"""
+    key = (store, kind)
+    if key not in batch_sizes:
+        batch_sizes[key] = AdaptiveBatchSize(store, kind, initial_size, min_size, max_size, target_seconds)
+    return batch_sizes[key]
@@ -0,0 +1,135 @@
+from common import write_log
+from collections import Counter
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+class BlobCache:
+    """
+    On-disk cache of downloaded binary assets (images, fonts, floor PNGs), stored once per
+    content hash so an asset shared by several stores is kept a single time.
+    Assets are looked up by a source key such as "image:1017.plus:logos/a.png" and are
+    downloaded straight to disk, callers get the path of the cached file.
+    Keys older than max_age seconds are fetched again, and the least recently used blobs
+    are evicted once the cache grows over max_bytes. Blobs fetched with pin=True are never
+    evicted until they are released, so callers can hold on to their path.
+    """
+    def __init__(self, path="asset_cache", max_bytes=2 * 1024 * 1024 * 1024, max_age=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pinned = Counter()  # hash -> number of callers holding the blob path
+        os.makedirs(path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS asset_keys (key TEXT PRIMARY KEY, hash TEXT, stored_at REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self.connection.commit()
+
+    def blob_path(self, hash_value):
+        return os.path.join(self.path, hash_value[:2], hash_value)
+
+    def get_path(self, key, pin=False):
+        """Get the path of the cached copy of a key, None if it is not cached or too old"""
+        with self.lock:
+            row = self.connection.execute("SELECT hash, stored_at FROM asset_keys WHERE key = ?", (key,)).fetchone()
+            if not row or time.time() - row[1] > self.max_age or not os.path.exists(self.blob_path(row[0])):
+                return None
+            if pin:
+                self.pinned[row[0]] += 1
+            self.connection.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (time.time(), row[0]))
+            self.connection.commit()
+        return self.blob_path(row[0])
+
+    def put_file(self, key, temp_path, hash_value, size, pin=False):
+        """Move a downloaded file with the given content hash into the cache and return its path"""
+        blob_path = self.blob_path(hash_value)
+        with self.lock:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if os.path.exists(blob_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, blob_path)
+            now = time.time()
+            self.connection.execute("INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)", (hash_value, size, now))
+            self.connection.execute("INSERT OR REPLACE INTO asset_keys (key, hash, stored_at) VALUES (?, ?, ?)", (key, hash_value, now))
+            self.connection.commit()
+            if pin:
+                self.pinned[hash_value] += 1
+            self.evict()
+        return blob_path
+
+    def release(self, blob_path):
+        """Release a blob fetched with pin=True, it can be evicted again once nobody holds it"""
+        hash_value = os.path.basename(blob_path)
+        with self.lock:
+            self.pinned[hash_value] -= 1
+            if self.pinned[hash_value] <= 0:
+                del self.pinned[hash_value]
+
+    def evict(self):
+        """Remove the least recently used blobs until the cache fits in max_bytes, the lock must be held"""
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # The most recent blob is kept even if it is larger than the whole cache, it is about to be used
+        for hash_value, size in self.connection.execute("SELECT hash, size FROM blobs ORDER BY last_used").fetchall()[:-1]:
+            if total <= self.max_bytes:
+                break
+            if hash_value in self.pinned:
+                continue
+            try:
+                os.remove(self.blob_path(hash_value))
+            except OSError:
+                pass
+            self.connection.execute("DELETE FROM blobs WHERE hash = ?", (hash_value,))
+            self.connection.execute("DELETE FROM asset_keys WHERE hash = ?", (hash_value,))
+            total -= size
+        self.connection.commit()
+
+    def fetch_path(self, key, download_to, pin=False):
+        """
+        Get the path of the cached copy of a key, or call download_to(file) to write the
+        content to a temporary file in chunks and cache it, so it is never held in memory.
+        With pin, the blob is kept until release is called with the returned path.
+        """
+        blob_path = self.get_path(key, pin)
+        if blob_path is not None:
+            write_log(f"Using cached copy of {key}", "cyan")
+            return blob_path
+        
+        temp_path = os.path.join(self.path, f"download.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, "wb") as temp_file:
+                hashing_file = HashingWriter(temp_file)
+                download_to(hashing_file)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return self.put_file(key, temp_path, hashing_file.hash.hexdigest(), hashing_file.size, pin)
+
+class HashingWriter:
+    """Binary file wrapper that hashes and counts what is written to it"""
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+# One cache per session, created on first use
+asset_cache = None
+asset_cache_lock = threading.Lock()
+
+def get_asset_cache():
+    """Get the asset cache of the session, creating it on first use"""
+    global asset_cache
+    with asset_cache_lock:
+        if asset_cache is None:
+            asset_cache = BlobCache()
+        return asset_cache
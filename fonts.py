@@ -1,8 +1,11 @@
 from common import write_log
 from endpoint_handler import endpoint_handler
+from blob_cache import get_asset_cache
+from streaming import post_multipart, stream_download
 import requests
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 def get_store_group_id(store_data, store):
     """Get store group ID from store data, safely handling None case."""
@@ -30,8 +33,8 @@ def get_store_group_id(store_data, store):
     
     return None
 
-def get_store_group_id_direct(domain, auth_token):
-    """Get store group ID directly via API call."""
+def get_store_group_id_direct(domain, auth_token, only_if_single=False):
+    """Get store group ID directly via API call, with only_if_single only when the domain has a single store group."""
     try:
         write_log(f"Attempting to fetch store groups directly from API", "cyan")
         response = requests.get(
@@ -46,6 +49,10 @@ def get_store_group_id_direct(domain, auth_token):
             # Print available store groups to help debug
             for sg in store_groups:
                 write_log(f"Available store group: ID={sg.get('id')}, Name={sg.get('name')}", "cyan")
+            
+            if only_if_single and len(store_groups) > 1:
+                write_log(f"Found {len(store_groups)} store groups in {domain}, cannot tell which one to use", "yellow")
+                return None
                 
             # Return the first store group ID if available
             group_id = store_groups[0].get('id')
@@ -91,39 +98,40 @@ def get_fonts_plaza(domain, store_group_id, auth_token):
         write_log(f"Error getting fonts from Plaza: {str(e)}", "red")
         return None
 
-def download_font_onprem(font_name, auth):
-    """Download font from onprem server."""
+def download_font_onprem(font_name, auth, pin=False):
+    """Download font from onprem server, returns the path of the local copy, pinned in the asset cache with pin."""
     try:
         url = endpoint_handler.get_full_url("store1", f"/api/public/file/v1/fonts/{font_name}")
         headers = endpoint_handler.get_headers("store1")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.content
+        download_to = stream_download(requests.get, url, headers=headers)
+        return get_asset_cache().fetch_path(f"font:{endpoint_handler.get_base_url('store1')}:{font_name}", download_to, pin=pin)
     except Exception as e:
         write_log(f"Error downloading font {font_name} from onprem: {str(e)}", "red")
         return None
 
-def download_font_plaza(domain, store_group_id, font_name, auth_token):
-    """Download font from Plaza server."""
+def download_font_plaza(domain, store_group_id, font_name, auth_token, pin=False):
+    """Download font from Plaza server, returns the path of the local copy, pinned in the asset cache with pin."""
+    download_to = stream_download(
+        requests.get,
+        f"https://central-manager.{domain}.pcm.pricer-plaza.com/api/private/web/store-groups/{store_group_id}/fonts/{font_name}",
+        headers={"Authorization": f"Bearer {auth_token}"}
+    )
+    
     try:
-        response = requests.get(
-            f"https://central-manager.{domain}.pcm.pricer-plaza.com/api/private/web/store-groups/{store_group_id}/fonts/{font_name}",
-            headers={"Authorization": f"Bearer {auth_token}"}
-        )
-        response.raise_for_status()
-        return response.content
+        return get_asset_cache().fetch_path(f"font:{domain}:{store_group_id}:{font_name}", download_to, pin=pin)
     except Exception as e:
         write_log(f"Error downloading font {font_name} from Plaza: {str(e)}", "red")
         return None
 
-def upload_font_plaza(domain, store_group_id, font_name, font_data, auth_token):
-    """Upload font to Plaza server."""
+def upload_font_plaza(domain, store_group_id, font_name, font_path, auth_token):
+    """Upload the font stored at font_path to Plaza server."""
     try:
-        files = {'fontFile': (font_name, font_data)}
-        response = requests.post(
+        files = [('fontFile', (font_name, font_path, 'application/octet-stream'))]
+        response = post_multipart(
+            requests.post,
             f"https://central-manager.{domain}.pcm.pricer-plaza.com/api/private/web/store-groups/{store_group_id}/fonts",
-            headers={"Authorization": f"Bearer {auth_token}"},
-            files=files
+            {"Authorization": f"Bearer {auth_token}"},
+            files
         )
         
         if response.status_code == 400:
@@ -145,17 +153,68 @@ def upload_font_plaza(domain, store_group_id, font_name, font_data, auth_token):
         write_log(f"Unexpected error uploading font {font_name}: {str(e)}", "red")
         return False
 
-def migrate_fonts(store1, store2, auth_token1, auth_token2, store_data1, store_data2):
-    """Migrate fonts from store1 to store2, handling both onprem and Plaza sources."""
-    source_is_onprem = is_onprem(store1)
+def get_font_name(font):
+    """Get the file name of a font, onprem and Plaza list them with different properties."""
+    return font.get('filename', font.get('name', None))
+
+def transfer_font(font_name, download, domain2, target_group_id, auth_token2):
+    """Download a font with download(font_name) and upload it to the target store group."""
+    write_log(f"Processing font: {font_name}", "cyan")
+    font_path = download(font_name)
+    if not font_path:
+        write_log(f"Failed to download font {font_name}", "red")
+        return False
     
-    if source_is_onprem:
-        # For Onprem to Plaza
-        write_log("Migrating fonts from Onprem to Plaza...", "cyan")
+    # Upload font to Plaza target
+    if upload_font_plaza(domain2, target_group_id, font_name, font_path, auth_token2):
+        write_log(f"Successfully migrated font: {font_name}", "green")
+        return True
+    return False
+
+def get_source_fonts(store1, auth_token1, store_data1):
+    """
+    List the fonts of the source store, onprem or Plaza.
+    Returns (font_names, download) with download(font_name, pin=False) returning the path of a
+    local copy, or (None, None) if no fonts were found.
+    """
+    if is_onprem(store1):
         fonts_list = get_fonts_onprem(store1, auth_token1)
+        download = lambda font_name, pin=False: download_font_onprem(font_name, auth_token1, pin)
+    else:
+        domain1 = store1.split('.')[1]
+        source_group_id = get_store_group_id(store_data1, store1)
+        if not source_group_id:
+            write_log("Could not find source store group ID, using store ID as fallback", "yellow")
+            source_group_id = store1.split('.')[0]
+        fonts_list = get_fonts_plaza(domain1, source_group_id, auth_token1)
+        download = lambda font_name, pin=False: download_font_plaza(domain1, source_group_id, font_name, auth_token1, pin)
+    
+    # Check if we got any fonts
+    if not fonts_list or len(fonts_list) == 0:
+        write_log("No fonts found in source store", "yellow")
+        return None, None
         
-        # Get target store group ID
-        domain2 = store2.split('.')[1]
+    write_log(f"Found {len(fonts_list)} fonts to migrate", "green")
+    font_names = []
+    for font in fonts_list:
+        font_name = get_font_name(font)
+        if not font_name:
+            write_log(f"Error: Could not determine font name from {font}", "red")
+            continue
+        font_names.append(font_name)
+    return font_names, download
+
+def migrate_fonts(store1, store2, auth_token1, auth_token2, store_data1, store_data2, workers=4):
+    """
+    Migrate fonts from store1 to store2, handling both onprem and Plaza sources.
+    Fonts already on the target store group are skipped, the others are transferred
+    by workers workers at the same time.
+    """
+    domain2 = store2.split('.')[1]
+    
+    if is_onprem(store1):
+        # For Onprem to Plaza
+        write_log("Migrating fonts from Onprem to Plaza...", "cyan")
         
         # Debug: Print store_data2 to see its content
         if store_data2:
@@ -173,52 +232,95 @@ def migrate_fonts(store1, store2, auth_token1, auth_token2, store_data1, store_d
             
     else:
         # For Plaza to Plaza
-        domain1, domain2 = store1.split('.')[1], store2.split('.')[1]
-        
-        # Get store group IDs (for Plaza to Plaza)
-        source_group_id = get_store_group_id(store_data1, store1)
         target_group_id = get_store_group_id(store_data2, store2)
         
-        if not source_group_id or not target_group_id:
-            write_log("Could not find store group IDs, using store IDs as fallback", "yellow")
-            source_group_id = source_group_id or store1.split('.')[0]
-            target_group_id = target_group_id or store2.split('.')[0]
-            
-        # Get list of fonts from Plaza source
-        fonts_list = get_fonts_plaza(domain1, source_group_id, auth_token1)
+        if not target_group_id:
+            write_log("Could not find target store group ID, using store ID as fallback", "yellow")
+            target_group_id = store2.split('.')[0]
     
-    # Check if we got any fonts
-    if not fonts_list or len(fonts_list) == 0:
-        write_log("No fonts found in source store", "yellow")
+    font_names, download = get_source_fonts(store1, auth_token1, store_data1)
+    if font_names is None:
         return False
-        
-    write_log(f"Found {len(fonts_list)} fonts to migrate", "green")
-    success_count = 0
     
-    # Process each font
-    for font in fonts_list:
-        # Handle different response formats
-        font_name = font.get('filename', font.get('name', None))
-        if not font_name:
-            write_log(f"Error: Could not determine font name from {font}", "red")
-            continue
-            
-        write_log(f"Processing font: {font_name}", "cyan")
+    # List the target fonts once instead of learning about each one from a failed upload
+    target_fonts = get_fonts_plaza(domain2, target_group_id, auth_token2) or []
+    existing = {get_font_name(font) for font in target_fonts}
+    skipped = [font_name for font_name in font_names if font_name in existing]
+    if skipped:
+        write_log(f"Skipping {len(skipped)} fonts already in target store: {', '.join(skipped)}", "yellow")
+    font_names = [font_name for font_name in font_names if font_name not in existing]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda font_name: transfer_font(font_name, download, domain2, target_group_id, auth_token2), font_names))
+    success_count = sum(results)
         
-        # Download font using appropriate method
-        if source_is_onprem:
-            font_data = download_font_onprem(font_name, auth_token1)
+    write_log(f"Font migration complete. {success_count}/{len(font_names)} fonts migrated successfully, {len(skipped)} already in target store", "green")
+    return True
+
+def upload_fonts_to_group(domain2, store_group_id, auth_token2, font_paths):
+    """
+    Upload downloaded fonts (font name -> local path) to a store group, skipping the ones it already has.
+    Returns the uploaded, skipped and failed font names.
+    """
+    existing = {get_font_name(font) for font in get_fonts_plaza(domain2, store_group_id, auth_token2) or []}
+    report = {"uploaded": [], "skipped": [], "failed": []}
+    for font_name, font_path in font_paths.items():
+        if font_name in existing:
+            report["skipped"].append(font_name)
+        elif upload_font_plaza(domain2, store_group_id, font_name, font_path, auth_token2):
+            report["uploaded"].append(font_name)
         else:
-            font_data = download_font_plaza(domain1, source_group_id, font_name, auth_token1)
-            
-        if not font_data:
-            write_log(f"Failed to download font {font_name}", "red")
+            report["failed"].append(font_name)
+    return report
+
+def fan_out_fonts(store1, auth_token1, store_data1, targets, workers=4):
+    """
+    Download the fonts of store1 once and upload them to the store groups of several target stores.
+    targets is a list of (store2, auth_token2, store_data2) tuples, target stores sharing a store
+    group are uploaded to once. Returns the report of each store group by store group ID, and
+    the target stores whose store group could not be resolved.
+    """
+    font_names, download = get_source_fonts(store1, auth_token1, store_data1)
+    if font_names is None:
+        return {}, []
+    
+    # The local copies are pinned in the asset cache until every store group has them
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        font_paths = dict(zip(font_names, executor.map(lambda font_name: download(font_name, pin=True), font_names)))
+    for font_name in [font_name for font_name, font_path in font_paths.items() if not font_path]:
+        write_log(f"Failed to download font {font_name}", "red")
+        del font_paths[font_name]
+    
+    # Resolve the store group of every target, several stores can share one
+    groups = {}  # (domain2, store group ID) -> (auth_token2, stores)
+    unresolved = []
+    for store2, auth_token2, store_data2 in targets:
+        domain2 = store2.split('.')[1]
+        # The domain's store group can only stand in for the store's own if there is no other
+        store_group_id = get_store_group_id(store_data2, store2) or get_store_group_id_direct(domain2, auth_token2, only_if_single=True)
+        if not store_group_id:
+            write_log(f"Could not find the store group of {store2}, skipping it", "red")
+            unresolved.append(store2)
             continue
-            
-        # Upload font to Plaza target
-        if upload_font_plaza(domain2, target_group_id, font_name, font_data, auth_token2):
-            success_count += 1
-            write_log(f"Successfully migrated font: {font_name}", "green")
-        
-    write_log(f"Font migration complete. {success_count}/{len(fonts_list)} fonts migrated successfully", "green")
-    return True
\ No newline at end of file
+        groups.setdefault((domain2, store_group_id), (auth_token2, []))[1].append(store2)
+    
+    write_log(f"Uploading {len(font_paths)} fonts to {len(groups)} store groups", "cyan")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        uploads = {
+            (domain2, store_group_id): executor.submit(upload_fonts_to_group, domain2, store_group_id, auth_token2, font_paths)
+            for (domain2, store_group_id), (auth_token2, _) in groups.items()
+        }
+    for font_path in font_paths.values():
+        get_asset_cache().release(font_path)
+    
+    reports = {}
+    for (domain2, store_group_id), upload in uploads.items():
+        report = reports[store_group_id] = upload.result()
+        stores = ", ".join(groups[(domain2, store_group_id)][1])
+        write_log(
+            f"Store group {store_group_id} ({stores}): {len(report['uploaded'])} uploaded, {len(report['skipped'])} already there, {len(report['failed'])} failed",
+            "red" if report["failed"] else "green"
+        )
+    if unresolved:
+        write_log(f"Fonts not uploaded to {len(unresolved)} stores with an unresolved store group: {', '.join(unresolved)}", "red")
+    return reports, unresolved
\ No newline at end of file
@@ -1,16 +1,61 @@
 from common import write_log
+from blob_cache import get_asset_cache
+from streaming import post_multipart, stream_download
 import requests
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Floor images seen during the session, keyed by (store, floor_id, image_type):
+# the local path of a downloaded image, True if it is only known to exist, False if it does not
+floor_images = {}
+floor_images_lock = threading.Lock()
+
+def get_floor_image_url(store, floor_id, image_type):
+    return f"https://{store}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{image_type}.png"
+
+def floor_image_exists(store, auth_token, floor_id, image_type):
+    """Check whether a floor image exists with a HEAD request, without downloading it"""
+    key = (store, floor_id, image_type)
+    with floor_images_lock:
+        if key in floor_images:
+            return bool(floor_images[key])
+    
+    url = get_floor_image_url(store, floor_id, image_type)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = requests.head(url, headers=headers, timeout=30)
+    if response.status_code == 405:
+        # HEAD not allowed, only read the status of a GET
+        with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+            pass
+    exists = response.status_code in range(200, 300)
+    with floor_images_lock:
+        floor_images.setdefault(key, exists)
+    return exists
+
+def get_floor_image(store, auth_token, floor_id, image_type):
+    """Get the local path of a floor image, downloaded once per session through the asset cache"""
+    key = (store, floor_id, image_type)
+    with floor_images_lock:
+        if isinstance(floor_images.get(key), str):
+            return floor_images[key]
+    
+    # Get image from source, streamed to the asset cache on disk
+    download_to = stream_download(requests.get, get_floor_image_url(store, floor_id, image_type), headers={"Authorization": f"Bearer {auth_token}"})
+    # Pinned, the path is reused for the rest of the session
+    image_path = get_asset_cache().fetch_path(f"geoloc:{store}:{floor_id}:{image_type}", download_to, pin=True)
+    with floor_images_lock:
+        floor_images[key] = image_path
+    return image_path
 
 def check_geoloc_config(store, auth_token, floor_id=0):
     try:
         # Check if at least one of graphical.png or blueprint.png exists
         found_one = False
         for image_type in ['graphical', 'blueprint']:
-            response = requests.get(
-                f"https://{store}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{image_type}.png",
-                headers={"Authorization": f"Bearer {auth_token}"}
-            )
-            if response.status_code in range(200, 300):
+            if floor_image_exists(store, auth_token, floor_id, image_type):
                 found_one = True
                 write_log(f"Found {image_type}.png configuration on {store}", "green")
             else:
@@ -37,21 +82,52 @@ def get_floors(store, auth_token):
         write_log(f"Error getting floors: {str(e)}", "red")
         return None
 
-def migrate_image_data(store1, store2, auth_token1, auth_token2, floor_id, image_type):
+def get_image_hash(store, auth_token, floor_id, image_type):
+    """SHA-256 of a floor image, streamed without keeping it, None if it cannot be read"""
+    url = get_floor_image_url(store, floor_id, image_type)
     try:
-        # Get image from source
-        get_response = requests.get(
-            f"https://{store1}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{image_type}.png",
-            headers={"Authorization": f"Bearer {auth_token1}"}
+        with requests.get(url, headers={"Authorization": f"Bearer {auth_token}"}, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+def layer_hash(data):
+    """Hash of a map layer, independent of property order and formatting"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def get_layer_hash(store, auth_token, floor_id, endpoint):
+    """Hash of the current map layer of a store, None if it cannot be read"""
+    try:
+        response = requests.get(
+            f"https://{store}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{endpoint}",
+            headers={"Authorization": f"Bearer {auth_token}"}
         )
-        get_response.raise_for_status()
+        response.raise_for_status()
+        return layer_hash(response.json())
+    except Exception:
+        return None
+
+def migrate_image_data(store1, store2, auth_token1, auth_token2, floor_id, image_type, skip_unchanged=True):
+    try:
+        # Get image from source
+        image_path = get_floor_image(store1, auth_token1, floor_id, image_type)
+        
+        # Asset cache blobs are named by the SHA-256 of their content
+        if skip_unchanged and get_image_hash(store2, auth_token2, floor_id, image_type) == os.path.basename(image_path):
+            write_log(f"{image_type} for floor {floor_id} is already up to date", "green")
+            return True
         
         # Post image to target
-        files = {'image': (f'{image_type}.png', get_response.content, 'image/png')}
-        post_response = requests.post(
+        files = [('image', (f'{image_type}.png', image_path, 'image/png'))]
+        post_response = post_multipart(
+            requests.post,
             f"https://{store2}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{image_type}.png",
-            headers={"Authorization": f"Bearer {auth_token2}"},
-            files=files
+            {"Authorization": f"Bearer {auth_token2}"},
+            files
         )
         post_response.raise_for_status()
         write_log(f"Successfully migrated {image_type} for floor {floor_id}", "green")
@@ -60,7 +136,7 @@ def migrate_image_data(store1, store2, auth_token1, auth_token2, floor_id, image
         write_log(f"Error migrating {image_type}: {str(e)}", "red")
         return False
 
-def migrate_json_data(store1, store2, auth_token1, auth_token2, floor_id, endpoint):
+def migrate_json_data(store1, store2, auth_token1, auth_token2, floor_id, endpoint, skip_unchanged=True):
     try:
         # Get data from source
         get_response = requests.get(
@@ -70,6 +146,11 @@ def migrate_json_data(store1, store2, auth_token1, auth_token2, floor_id, endpoi
         get_response.raise_for_status()
         data = get_response.json()
         
+        # Compare with the current layer of the target, so unchanged layers are not written again
+        if skip_unchanged and get_layer_hash(store2, auth_token2, floor_id, endpoint) == layer_hash(data):
+            write_log(f"{endpoint} for floor {floor_id} is already up to date", "green")
+            return True
+        
         # Put data to target
         put_response = requests.put(
             f"https://{store2}.pcm.pricer-plaza.com/api/public/map/v1/geo-store/floors/{floor_id}/{endpoint}",
@@ -112,7 +193,29 @@ def migrate_shelf_length(store1, store2, auth_token1, auth_token2):
         write_log(f"Error migrating shelf length: {str(e)}", "red")
         return False
 
-def migrate_geoloc(store1, store2, auth_token1, auth_token2):
+def migrate_floor(store1, store2, auth_token1, auth_token2, floor_id):
+    """
+    Migrate the images and map layers of one floor, each group transferred in parallel.
+    The images go first, as before, so the layers are written on top of them.
+    """
+    write_log(f"Processing floor {floor_id}", "cyan")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        # Migrate images first
+        images = list(executor.map(
+            lambda image_type: migrate_image_data(store1, store2, auth_token1, auth_token2, floor_id, image_type),
+            ['graphical', 'blueprint']
+        ))
+        if not all(images):
+            return False
+
+        # Migrate JSON data
+        layers = list(executor.map(
+            lambda endpoint: migrate_json_data(store1, store2, auth_token1, auth_token2, floor_id, endpoint),
+            ['obstacles', 'graphical-map-layer', 'floor-boundary', 'blueprint-map-layer']
+        ))
+    return all(layers)
+
+def migrate_geoloc(store1, store2, auth_token1, auth_token2, floor_workers=4):
     write_log(f"Starting geo-store migration from {store1} to {store2}", "cyan")
     
     # Check geoloc configuration exists
@@ -124,20 +227,15 @@ def migrate_geoloc(store1, store2, auth_token1, auth_token2):
     if not floors:
         return False
 
-    # Process each floor
-    for floor in floors:
-        floor_id = floor.get("floor", 0)
-        write_log(f"Processing floor {floor_id}", "cyan")
-
-        # Migrate images first
-        for image_type in ['graphical', 'blueprint']:
-            if not migrate_image_data(store1, store2, auth_token1, auth_token2, floor_id, image_type):
-                return False
-
-        # Migrate JSON data
-        for endpoint in ['obstacles', 'graphical-map-layer', 'floor-boundary', 'blueprint-map-layer']:
-            if not migrate_json_data(store1, store2, auth_token1, auth_token2, floor_id, endpoint):
-                return False
+    # Process the floors concurrently
+    with ThreadPoolExecutor(max_workers=floor_workers) as executor:
+        results = list(executor.map(
+            lambda floor: migrate_floor(store1, store2, auth_token1, auth_token2, floor.get("floor", 0)),
+            floors
+        ))
+    if not all(results):
+        write_log(f"Geoloc migration failed for {results.count(False)} of {len(floors)} floors", "red")
+        return False
 
     # Migrate shelf length
     if not migrate_shelf_length(store1, store2, auth_token1, auth_token2):
@@ -0,0 +1,74 @@
+from common import write_log
+from collections import defaultdict
+import gzip
+import threading
+import requests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Stores that refused a compressed request body, they get uncompressed bodies from then on
+compression_rejected = set()
+
+# Request body bytes per store, before and after compression
+wire_bytes = defaultdict(lambda: {"raw": 0, "sent": 0})
+wire_bytes_lock = threading.Lock()
+
+def accept_encoding():
+    """Accept-Encoding header value for the response encodings this client can decode"""
+    return "zstd, gzip, deflate" if zstandard else "gzip, deflate"
+
+def compress_body(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+def record_wire_bytes(store, raw_size, sent_size):
+    with wire_bytes_lock:
+        wire_bytes[store]["raw"] += raw_size
+        wire_bytes[store]["sent"] += sent_size
+
+def is_encoding_rejection(response):
+    """True if the response refuses the request because of its Content-Encoding"""
+    if response.status_code == 415:
+        return True
+    text = response.text.lower()
+    return response.status_code == 400 and any(word in text for word in ["encoding", "compress", "gzip", "zstd"])
+
+def patch_json(store, url, headers, body, timeout, compress=None):
+    """
+    PATCH an encoded JSON body, compressed with Content-Encoding when compress is "gzip" or "zstd".
+    zstd falls back to gzip when the zstandard package is not installed.
+    If the store refuses a compressed body because of its encoding (415, or a 400 that says so),
+    the body is sent again uncompressed and compression is turned off for that store for the
+    rest of the session.
+    """
+    headers = dict(headers, **{"Accept-Encoding": accept_encoding()})
+
+    if compress and store not in compression_rejected:
+        encoding = "zstd" if compress == "zstd" and zstandard else "gzip"
+        compressed = compress_body(body, encoding)
+        response = requests.patch(url, headers=dict(headers, **{"Content-Encoding": encoding}), data=compressed, timeout=timeout)
+        if not is_encoding_rejection(response):
+            record_wire_bytes(store, len(body), len(compressed))
+            return response
+
+        write_log(f"{store} does not accept {encoding} request bodies (status {response.status_code}), sending uncompressed from now on", "yellow")
+        compression_rejected.add(store)
+        response = requests.patch(url, headers=headers, data=body, timeout=timeout)
+        record_wire_bytes(store, len(body), len(compressed) + len(body))
+        return response
+
+    response = requests.patch(url, headers=headers, data=body, timeout=timeout)
+    record_wire_bytes(store, len(body), len(body))
+    return response
+
+def report_wire_bytes(store):
+    """Log the request body bytes sent to a store, before and after compression"""
+    stats = wire_bytes.get(store)
+    if not stats or not stats["raw"]:
+        return
+    saved = 100 * (1 - stats["sent"] / stats["raw"])
+    write_log(f"Sent {stats['raw']} bytes of request bodies to {store} as {stats['sent']} bytes on the wire ({saved:.0f}% saved)", "cyan")
@@ -1,9 +1,23 @@
 import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from common import write_log
+from blob_cache import get_asset_cache
+from streaming import post_multipart, stream_download
+from tqdm import tqdm
 from urllib.parse import quote
 
-def get_folders_and_files(store, auth_token, folder_path="", page_index=0, page_size=100):
+thread_local = threading.local()
+
+def get_session():
+    """Get the requests session of the current thread, so each worker reuses its own connections"""
+    if not hasattr(thread_local, "session"):
+        thread_local.session = requests.Session()
+    return thread_local.session
+
+def get_folder_page(store, auth_token, folder_path="", page_index=0, page_size=100):
+    """Get one page of the folders and files of an image folder, returns None on error"""
     normalized_path = folder_path.replace('\\', '/')
     url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/image-folder"
     params = {
@@ -14,78 +28,271 @@ def get_folders_and_files(store, auth_token, folder_path="", page_index=0, page_
     headers = {"Authorization": f"Bearer {auth_token}"}
     
     try:
-        response = requests.get(url, params=params, headers=headers)
+        response = get_session().get(url, params=params, headers=headers, timeout=60)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         write_log(f"Error fetching folders and files: {str(e)}", "red")
-        return []
-    
-    data = response.json()
-    # Filter out pricer_logo.png from the files list
-    files = [os.path.join(folder_path, f).replace('\\', '/') for f in data["files"] if f.lower() != "pricer_logo.png"]
-    
-    for folder in data["folders"]:
-        # Use os.path.join for the subfolder path instead of combining with current folder_path
-        subfolder_path = folder if not folder_path else f"{folder_path}/{folder}"
-        files.extend(get_folders_and_files(store, auth_token, subfolder_path))
+        return None
+    return response.json()
+
+def iter_folder_files(store, auth_token, folder_path="", page_size=100, workers=4):
+    """
+    Yield the image file paths under folder_path as soon as their page is listed.
+    The folder tree is crawled from a work queue, sibling folders and the remaining pages
+    of a folder (known from totalSize on its first page) are fetched with workers workers.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
         
-    if data["totalSize"] > (page_index + 1) * page_size:
-        files.extend(get_folders_and_files(store, auth_token, folder_path, page_index + 1))
+        def submit_page(path, page_index):
+            pending[executor.submit(get_folder_page, store, auth_token, path, page_index, page_size)] = (path, page_index)
         
-    return files
+        submit_page(folder_path, 0)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for page in done:
+                path, page_index = pending.pop(page)
+                data = page.result()
+                if data is None:
+                    continue
+                
+                if page_index == 0:
+                    for next_index in range(1, -(-data["totalSize"] // page_size)):
+                        submit_page(path, next_index)
+                for folder in data["folders"]:
+                    submit_page(folder if not path else f"{path}/{folder}", 0)
+                
+                # Filter out pricer_logo.png from the files list
+                for f in data["files"]:
+                    if f.lower() != "pricer_logo.png":
+                        yield os.path.join(path, f).replace('\\', '/')
+
+def get_folders_and_files(store, auth_token, folder_path="", page_size=100):
+    return list(iter_folder_files(store, auth_token, folder_path, page_size))
 
-def download_file(store, auth_token, file_path):
+def download_file(store, auth_token, file_path, timeout=60, pin=False):
+    """
+    Download an image in chunks to the asset cache and return the path of the local copy
+    With pin, the copy stays in the cache until it is released
+    """
     normalized_path = file_path.replace('\\', '/')
     url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/image"
     params = {"filePath": normalized_path}  # requests will handle URL encoding
     headers = {"Authorization": f"Bearer {auth_token}"}
     
-    response = requests.get(url, params=params, headers=headers)
-    response.raise_for_status()
-    return response.content
+    download_to = stream_download(get_session().get, url, params=params, headers=headers, timeout=timeout)
+    return get_asset_cache().fetch_path(f"image:{store}:{normalized_path}", download_to, pin=pin)
 
-def upload_file(store, auth_token, file_path, file_content):
-    # Get destination folder path, defaulting to root '/'
+def get_folder_path(file_path):
+    """Get the destination folder path of a file, defaulting to root '/'"""
     folder_path = '/' + os.path.dirname(file_path).lstrip('/')
     if folder_path == '/.': folder_path = '/'
-    
-    url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/image"
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    
+    return folder_path
+
+def get_content_type(file_path):
     # Get file extension for content type
     ext = os.path.splitext(file_path)[1].lower()
-    content_type = {
+    return {
         '.png': 'image/png',
         '.bmp': 'image/bmp',
+        '.gif': 'image/gif',
         '.jpg': 'image/jpeg',
         '.jpeg': 'image/jpeg'
     }.get(ext, 'application/octet-stream')
+
+def upload_file(store, auth_token, file_path, local_path, timeout=120):
+    """Upload the image stored at local_path to file_path, streaming it from disk"""
+    url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/image"
+    headers = {"Authorization": f"Bearer {auth_token}"}
     
-    files = {
-        'image': (
+    files = [
+        ('image', (
             os.path.basename(file_path),
-            file_content,
-            content_type
-        )
-    }
+            local_path,
+            get_content_type(file_path)
+        ))
+    ]
     
-    params = {'filePath': folder_path}
-    response = requests.post(url, headers=headers, files=files, params=params)
+    params = {'filePath': get_folder_path(file_path)}
+    response = post_multipart(get_session().post, url, headers, files, params=params, timeout=timeout)
     response.raise_for_status()
+
+def upload_files(store, auth_token, folder_path, files, timeout=300):
+    """
+    Upload several images to one folder in a single multipart request
+    files is a list of (file_path, local_path) tuples, returns the response
+    """
+    url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/images"
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    images = [
+        ('images', (os.path.basename(file_path), local_path, get_content_type(file_path)))
+        for file_path, local_path in files
+    ]
+    return post_multipart(get_session().post, url, headers, images, params={'filePath': folder_path}, timeout=timeout)
+
+# Stores without the multi-file upload endpoint, such as older versions, get one request per file
+bulk_upload_unavailable = set()
+
+def upload_folder_files(store, auth_token, folder_path, files):
+    """
+    Upload files of one folder with the multi-file endpoint, falling back to one request per file
+    when the endpoint is not available or refuses the batch.
+    Returns the failed files with their error.
+    """
+    if store not in bulk_upload_unavailable and len(files) > 1:
+        try:
+            response = upload_files(store, auth_token, folder_path, files)
+            if response.status_code in [200, 201]:
+                return {}
+            if response.status_code in [404, 405, 501]:
+                write_log(f"Multi-file image upload not available on {store}, uploading files one by one", "yellow")
+                bulk_upload_unavailable.add(store)
+            else:
+                write_log(f"Upload of {len(files)} images to {folder_path} failed with status {response.status_code}, uploading them one by one", "yellow")
+        except Exception as e:
+            write_log(f"Upload of {len(files)} images to {folder_path} failed, uploading them one by one: {str(e)}", "yellow")
     
-def migrate_images(store1, store2, auth_token1, auth_token2):
-    write_log(f"Fetching files from {store1}", "cyan")
-    files = get_folders_and_files(store1, auth_token1)
-    
-    for file in files:
-        write_log(f"Downloading {file} from {store1}", "cyan")
-        file_content = download_file(store1, auth_token1, file)
-        
-        write_log(f"Uploading {file} to {store2}", "cyan")
+    failed = {}
+    for file_path, local_path in files:
         try:
-            upload_file(store2, auth_token2, file, file_content)
-            write_log(f"Successfully uploaded {file} to {store2}", "green") 
+            upload_file(store, auth_token, file_path, local_path)
         except Exception as e:
-            write_log(f"Failed to upload {file} to {store2}: {str(e)}", "red")
-            
-    write_log("Image migration complete", "green")
\ No newline at end of file
+            failed[file_path] = f"upload failed: {str(e)}"
+    return failed
+
+def get_file_size(store, auth_token, file_path, timeout=30):
+    """Get the size of an image from a HEAD request, None when the store does not report it"""
+    url = f"https://{store}.pcm.pricer-plaza.com/api/public/file/v1/image"
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    try:
+        response = get_session().head(url, params={"filePath": file_path.replace('\\', '/')}, headers=headers, timeout=timeout)
+        if response.status_code == 200 and response.headers.get("Content-Length"):
+            return int(response.headers["Content-Length"])
+    except Exception:
+        pass
+    return None
+
+def fetch_file(store, auth_token, file):
+    """
+    Download one image, returns (local_path, error) with error None on success
+    The local copy is pinned in the asset cache until it is released after its upload
+    """
+    try:
+        return download_file(store, auth_token, file, pin=True), None
+    except Exception as e:
+        return None, f"download failed: {str(e)}"
+
+def fetch_changed_file(store1, store2, auth_token1, auth_token2, file):
+    """
+    Download an image that already exists on store2 only if its size differs,
+    returns (None, None) when both stores report the same size or no size at all
+    """
+    source_size = get_file_size(store1, auth_token1, file)
+    target_size = get_file_size(store2, auth_token2, file)
+    if source_size == target_size or source_size is None or target_size is None:
+        return None, None
+    return fetch_file(store1, auth_token1, file)
+
+def migrate_images(store1, store2, auth_token1, auth_token2, workers=8, max_request_bytes=20 * 1024 * 1024, max_files_per_request=50, skip_existing=True, compare_sizes=True):
+    """
+    Copy all images from store1 to store2 with workers files downloaded at the same time.
+    Files are streamed through the asset cache on disk, grouped by folder and uploaded
+    together in requests of up to max_files_per_request files and max_request_bytes bytes.
+    With skip_existing, files whose path already exists on store2 are not transferred,
+    unless compare_sizes is set (the default) and both stores report a different size for them.
+    A file that fails is logged and does not stop the others.
+    """
+    existing = set()
+    if skip_existing:
+        write_log(f"Listing the files already on {store2}", "cyan")
+        existing = set(iter_folder_files(store2, auth_token2))
+        write_log(f"Found {len(existing)} files on {store2}", "cyan")
+    
+    # Files are transferred while the source folder tree is still being crawled
+    write_log(f"Transferring files from {store1} to {store2} with {workers} workers", "cyan")
+    files = iter_folder_files(store1, auth_token1)
+    total_files = 0
+    skipped_files = 0
+    
+    failed = {}
+    failed_lock = threading.Lock()
+    progress = tqdm(desc="Transferring images", unit=" files")
+    # Bound the downloaded files waiting for an upload worker
+    upload_slots = threading.BoundedSemaphore(workers * 2)
+    
+    def on_uploaded(folder_files, upload):
+        upload_slots.release()
+        for _, local_path in folder_files:
+            get_asset_cache().release(local_path)
+        errors = upload.result()
+        with failed_lock:
+            failed.update(errors)
+        for file, _ in folder_files:
+            if file in errors:
+                write_log(f"Failed to transfer {file} to {store2}: {errors[file]}", "red")
+            else:
+                write_log(f"Successfully uploaded {file} to {store2}", "green")
+        progress.update(len(folder_files))
+    
+    with ThreadPoolExecutor(max_workers=workers) as downloader, ThreadPoolExecutor(max_workers=workers) as uploader:
+        def submit_upload(folder_path, folder_files):
+            upload_slots.acquire()
+            upload = uploader.submit(upload_folder_files, store2, auth_token2, folder_path, folder_files)
+            upload.add_done_callback(lambda upload: on_uploaded(folder_files, upload))
+        
+        folders = {}  # folder path -> downloaded (file, local_path) waiting to be uploaded
+        files_iter = iter(files)
+        downloads = {}
+        
+        def submit_downloads():
+            nonlocal total_files, skipped_files
+            # Keep a bounded number of downloads running, the next files are taken as others finish
+            while len(downloads) < workers * 2:
+                file = next(files_iter, None)
+                if file is None:
+                    return
+                total_files += 1
+                if file not in existing:
+                    downloads[downloader.submit(fetch_file, store1, auth_token1, file)] = file
+                elif compare_sizes:
+                    downloads[downloader.submit(fetch_changed_file, store1, store2, auth_token1, auth_token2, file)] = file
+                else:
+                    skipped_files += 1
+                    progress.update(1)
+        
+        submit_downloads()
+        while downloads:
+            done, _ = wait(downloads, return_when=FIRST_COMPLETED)
+            for download in done:
+                file = downloads.pop(download)
+                local_path, error = download.result()
+                if error:
+                    with failed_lock:
+                        failed[file] = error
+                    write_log(f"Failed to transfer {file} to {store2}: {error}", "red")
+                    progress.update(1)
+                    continue
+                if local_path is None:
+                    # Same size on both stores
+                    skipped_files += 1
+                    progress.update(1)
+                    continue
+                
+                folder_path = get_folder_path(file)
+                folder_files = folders.setdefault(folder_path, [])
+                if folder_files and (len(folder_files) >= max_files_per_request or sum(os.path.getsize(path) for _, path in folder_files) + os.path.getsize(local_path) > max_request_bytes):
+                    submit_upload(folder_path, folder_files)
+                    folder_files = folders[folder_path] = []
+                folder_files.append((file, local_path))
+            submit_downloads()
+        
+        for folder_path, folder_files in folders.items():
+            if folder_files:
+                submit_upload(folder_path, folder_files)
+    progress.close()
+    
+    if failed:
+        write_log(f"Image migration complete, {total_files - skipped_files - len(failed)} transferred, {skipped_files} already on {store2}, {len(failed)} failed: {', '.join(failed)}", "yellow")
+    else:
+        write_log(f"Image migration complete, {total_files - skipped_files} files transferred, {skipped_files} already on {store2}", "green")
+    return failed
@@ -0,0 +1,78 @@
+from common import write_log
+import hashlib
+import json
+import sqlite3
+import threading
+
+# Read-only properties set by the store itself, they are left out of the content hash
+HASH_IGNORED_PROPERTIES = ["lastUpdated", "links"]
+
+def item_hash(item):
+    """Hash of the item content, independent of property order"""
+    content = {key: value for key, value in item.items() if key not in HASH_IGNORED_PROPERTIES}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+class ItemHashIndex:
+    """
+    Local SQLite index of item ID -> content hash of the items uploaded to a target store,
+    used to upload only new or changed items on the next run.
+    """
+    def __init__(self, store, path="item_index.sqlite"):
+        self.store = store
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS item_hashes (store TEXT, item_id TEXT, hash TEXT, PRIMARY KEY (store, item_id))"
+        )
+        self.connection.commit()
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM item_hashes WHERE store = ?", (self.store,)).fetchone()[0]
+
+    def known_hashes(self, item_ids):
+        """Get the stored hashes of the given item IDs"""
+        known = {}
+        with self.lock:
+            # Stay under SQLite's limit on query parameters
+            for i in range(0, len(item_ids), 500):
+                chunk = item_ids[i:i+500]
+                rows = self.connection.execute(
+                    f"SELECT item_id, hash FROM item_hashes WHERE store = ? AND item_id IN ({','.join('?' * len(chunk))})",
+                    [self.store] + chunk
+                )
+                known.update(rows)
+        return known
+
+    def changed_items(self, items):
+        """
+        Filter a batch down to the items that are new or changed since they were last uploaded
+        Returns (changed_items, hashes) with hashes by item ID for the changed items
+        """
+        hashes = {item.get("itemId"): item_hash(item) for item in items}
+        known = self.known_hashes(list(hashes))
+        changed = [item for item in items if known.get(item.get("itemId")) != hashes[item.get("itemId")]]
+        return changed, {item.get("itemId"): hashes[item.get("itemId")] for item in changed}
+
+    def mark_uploaded(self, hashes):
+        """Record the hashes of items the target store has accepted"""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO item_hashes (store, item_id, hash) VALUES (?, ?, ?)",
+                [(self.store, item_id, hash_value) for item_id, hash_value in hashes.items()]
+            )
+            self.connection.commit()
+
+    def rebuild(self, item_batches):
+        """Replace the index content with the hashes of the items currently on the target store"""
+        with self.lock:
+            self.connection.execute("DELETE FROM item_hashes WHERE store = ?", (self.store,))
+        total = 0
+        for items in item_batches:
+            self.mark_uploaded({item.get("itemId"): item_hash(item) for item in items})
+            total += len(items)
+        write_log(f"Rebuilt item index for {self.store} from {total} target items", "green")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
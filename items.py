@@ -1,11 +1,21 @@
 from common import write_log
 from endpoint_handler import endpoint_handler
+from request_poller import RequestPoller
+from batch_sizing import AdaptiveBatchSize, get_batch_size
+from item_index import ItemHashIndex
+from migration_journal import MigrationJournal
+from http_compression import accept_encoding, patch_json, report_wire_bytes
+from quarantine import QuarantineFile
+from streaming import iter_from_threads
 import requests
 import time
 import json
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 def get_item_batch(store, auth_token, start=0, limit=1000):
-    """Fetch a batch of items from the store"""
+    """Fetch a batch of items from the store, None if it could not be fetched"""
     try:
         # Check if this is an onprem store
         is_onprem = not "." in store or ":" in store
@@ -13,12 +23,14 @@ def get_item_batch(store, auth_token, start=0, limit=1000):
         if is_onprem:
             url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/items?projection=M&start={start}&limit={limit}")
             headers = endpoint_handler.get_headers("store1")
+            headers["Accept-Encoding"] = accept_encoding()
             response = requests.get(url, headers=headers, timeout=60)
         else:
             response = requests.get(
                 f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items?projection=M&start={start}&limit={limit}",
                 headers={
                     "accept": "application/json",
+                    "Accept-Encoding": accept_encoding(),
                     "Authorization": f"Bearer {auth_token}"
                 },
                 timeout=60  # Increased timeout for large payloads
@@ -29,10 +41,51 @@ def get_item_batch(store, auth_token, start=0, limit=1000):
         return items
     except Exception as e:
         write_log(f"Error fetching items from {store} (batch starting at {start}): {str(e)}", "red")
-        return []
+        return None
+
+def get_item_batch_raw(store, auth_token, start=0, limit=1000):
+    """
+    Fetch a batch of items from the store as the raw JSON response body, without decoding it
+    Returns None if the batch could not be fetched
+    """
+    try:
+        # Check if this is an onprem store
+        is_onprem = not "." in store or ":" in store
+        
+        if is_onprem:
+            url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/items?projection=M&start={start}&limit={limit}")
+            headers = endpoint_handler.get_headers("store1")
+            headers["Accept-Encoding"] = accept_encoding()
+            response = requests.get(url, headers=headers, timeout=60)
+        else:
+            response = requests.get(
+                f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items?projection=M&start={start}&limit={limit}",
+                headers={
+                    "accept": "application/json",
+                    "Accept-Encoding": accept_encoding(),
+                    "Authorization": f"Bearer {auth_token}"
+                },
+                timeout=60
+            )
+        response.raise_for_status()
+        body = response.content
+        write_log(f"Retrieved {len(body)} bytes of items from {store} (batch starting at {start})", "green")
+        return body
+    except Exception as e:
+        write_log(f"Error fetching items from {store} (batch starting at {start}): {str(e)}", "red")
+        return None
+
+def batch_length(items):
+    """
+    Number of items in a batch, raw batches are not decoded so only an empty one
+    can be counted, None is returned otherwise
+    """
+    if isinstance(items, bytes):
+        return 0 if items.strip() in [b"", b"[]"] else None
+    return len(items)
 
 def get_linked_item_batch(store, auth_token, start=0, limit=1000):
-    """Fetch a batch of linked items from the store"""
+    """Fetch a batch of linked items from the store, None if it could not be fetched"""
     try:
         # Check if this is an onprem store
         is_onprem = not "." in store or ":" in store
@@ -61,14 +114,14 @@ def get_linked_item_batch(store, auth_token, start=0, limit=1000):
             # If result is already a list, use it directly
             items = result
         else:
-            items = []
             write_log(f"Unexpected response format from {store} linked items API", "red")
+            return None
         
         write_log(f"Retrieved {len(items)} linked items from {store} (batch starting at {start})", "green")
         return items
     except Exception as e:
         write_log(f"Error fetching linked items from {store} (batch starting at {start}): {str(e)}", "red")
-        return []
+        return None
 
 def upload_items(store, auth_token, items):
     """Upload a batch of items to the store"""
@@ -103,222 +156,533 @@ def upload_items(store, auth_token, items):
         write_log(f"Error uploading items to {store}: {str(e)}", "red")
         return False
 
-def check_request_status(store, auth_token, request_id, max_retries=6, retry_interval=15):
-    """Check the status of a request with retries for IN_PROGRESS status"""
-    retries = 0
-    logged_unknown_properties = set()  # Track properties with unknown property errors
+def get_items_result(store, auth_token, request_id):
+    """Fetch the items-result of an upload request, returns (finished, result)"""
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
     
-    while retries <= max_retries:
-        try:
-            # Check if this is an onprem store
-            is_onprem = not "." in store or ":" in store
-            
-            if is_onprem:
-                url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/items-result/{request_id}?excludeItemResults=false&excludeItemErrorCount=false")
-                headers = endpoint_handler.get_headers("store1")
-                response = requests.get(url, headers=headers)
-            else:
-                response = requests.get(
-                    f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items-result/{request_id}?excludeItemResults=false&excludeItemErrorCount=false",
-                    headers={
-                        "accept": "application/json",
-                        "Authorization": f"Bearer {auth_token}"
-                    }
-                )
-            response.raise_for_status()
-            result = response.json()
-            status = result.get("status")
-            
-            if status == "COMPLETED":
-                # Safely get itemErrorCount with a default of 0
-                error_count = result.get("itemErrorCount", 0)
-                
-                # Check if there are errors to report
-                if error_count and error_count > 0:
-                    write_log(f"Upload request {request_id} completed with {error_count} errors", "yellow")
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/items-result/{request_id}?excludeItemResults=false&excludeItemErrorCount=false")
+        headers = endpoint_handler.get_headers("store1")
+        response = requests.get(url, headers=headers, timeout=60)
+    else:
+        response = requests.get(
+            f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items-result/{request_id}?excludeItemResults=false&excludeItemErrorCount=false",
+            headers={
+                "accept": "application/json",
+                "Authorization": f"Bearer {auth_token}"
+            },
+            timeout=60
+        )
+    response.raise_for_status()
+    result = response.json()
+    return result.get("status") != "IN_PROGRESS", result
+
+def report_items_result(request_id, result, logged_unknown_properties):
+    """Log the outcome of a finished upload request, returns True if it completed"""
+    if result is None:
+        return False
+    
+    status = result.get("status")
+    if status != "COMPLETED":
+        write_log(f"Upload request {request_id} status: {status}", "yellow")
+        return False
+    
+    # Safely get itemErrorCount with a default of 0
+    error_count = result.get("itemErrorCount", 0)
+    
+    # Check if there are errors to report
+    if error_count and error_count > 0:
+        write_log(f"Upload request {request_id} completed with {error_count} errors", "yellow")
+        
+        # Only process itemResults if it exists and is a list
+        item_results = result.get("itemResults", [])
+        if item_results and isinstance(item_results, list):
+            for item_result in item_results:
+                # Safely check for errors
+                errors = item_result.get("errors", []) if item_result else []
+                if errors and len(errors) > 0:
+                    item_id = item_result.get("itemId", "unknown")
                     
-                    # Only process itemResults if it exists and is a list
-                    item_results = result.get("itemResults", [])
-                    if item_results and isinstance(item_results, list):
-                        for item_result in item_results:
-                            # Safely check for errors
-                            errors = item_result.get("errors", []) if item_result else []
-                            if errors and len(errors) > 0:
-                                item_id = item_result.get("itemId", "unknown")
-                                
-                                for error in errors:
-                                    if error and isinstance(error, dict):
-                                        prop = error.get("property", "unknown")
-                                        err_msg = error.get("error", "unknown error")
-                                        
-                                        # Only log ERROR_UNKNOWN_ITEM_PROPERTY once per property
-                                        if err_msg == "ERROR_UNKNOWN_ITEM_PROPERTY":
-                                            if prop not in logged_unknown_properties:
-                                                logged_unknown_properties.add(prop)
-                                                write_log(f"  - Property: {prop}, Error: {err_msg}", "red")
-                                        else:
-                                            # Log all other errors normally
-                                            write_log(f"  - Item {item_id}, Property: {prop}, Error: {err_msg}", "red")
-                else:
-                    write_log(f"Upload request {request_id} completed successfully", "green")
-                return True
-            elif status == "IN_PROGRESS":
-                if retries < max_retries:
-                    write_log(f"Upload request {request_id} is still in progress. Retrying in {retry_interval} seconds... ({retries+1}/{max_retries})", "yellow")
-                    time.sleep(retry_interval)
-                    retries += 1
-                    continue
-                else:
-                    write_log(f"Upload request {request_id} still in progress after {max_retries} retries", "red")
-                    return False
-            else:
-                write_log(f"Upload request {request_id} status: {status}", "yellow")
-                return False
-                
-        except Exception as e:
-            write_log(f"Error checking status for request ID {request_id}: {str(e)}", "red")
-            return False
+                    for error in errors:
+                        if error and isinstance(error, dict):
+                            prop = error.get("property", "unknown")
+                            err_msg = error.get("error", "unknown error")
+                            
+                            # Only log ERROR_UNKNOWN_ITEM_PROPERTY once per property
+                            if err_msg == "ERROR_UNKNOWN_ITEM_PROPERTY":
+                                if prop not in logged_unknown_properties:
+                                    logged_unknown_properties.add(prop)
+                                    write_log(f"  - Property: {prop}, Error: {err_msg}", "red")
+                            else:
+                                # Log all other errors normally
+                                write_log(f"  - Item {item_id}, Property: {prop}, Error: {err_msg}", "red")
+    else:
+        write_log(f"Upload request {request_id} completed successfully", "green")
+    return True
+
+def failed_item_ids(result):
+    """
+    IDs of the items an items-result reports as not successful, worth sending again.
+    Errors about a single property, such as ERROR_UNKNOWN_ITEM_PROPERTY, come back the same
+    on every try and do not count.
+    """
+    failed = []
+    for item_result in result.get("itemResults") or []:
+        if not item_result:
+            continue
+        errors = item_result.get("errors") or []
+        item_errors = [error for error in errors if not (isinstance(error, dict) and error.get("property"))]
+        if item_errors or (not errors and str(item_result.get("status", "")).startswith("ERROR")):
+            failed.append(item_result.get("itemId"))
+    return failed
+
+def read_ahead_batches(fetch_batch, store, auth_token, batch_size=1000, max_batches_in_flight=4, start_index=0, paged=False):
+    """
+    Fetch batches from the source store on a background thread and yield them in order
+    as (start_index, limit, items) tuples, so the source is read while the target is being written.
+    batch_size is either a fixed size or an AdaptiveBatchSize read before each fetch.
+    At most max_batches_in_flight fetched batches are held in memory at any time.
+    With paged, fetch_batch takes a page number instead of an offset and start_index counts pages.
+    fetch_batch returns None when a batch cannot be fetched, which raises an exception here
+    instead of ending the read as if the data was complete.
+    """
+    def producer(put):
+        next_start = start_index
+        while True:
+            limit = batch_size.size if isinstance(batch_size, AdaptiveBatchSize) else batch_size
+            items = fetch_batch(store, auth_token, next_start, limit)
+            if items is None:
+                raise RuntimeError(f"Could not fetch the batch starting at {'page' if paged else 'index'} {next_start} from {store}")
+            count = batch_length(items)
+            if not count and count is not None:
+                return
+            if not put((next_start, limit, items)):
+                return
+            # If we got less than the batch size, we've reached the end
+            if count is not None and count < limit:
+                return
+            next_start += 1 if paged else limit
     
-    return False  # If we get here, max retries were exceeded
+    yield from iter_from_threads([producer], max_batches_in_flight)
 
-def migrate_items(store1, store2, auth_token1, auth_token2):
-    """Migrate all items from store1 to store2"""
-    write_log(f"Starting item migration from {store1} to {store2}", "cyan")
-    total_items = 0
-    batch_size = 1000
-    request_ids = []
+def has_item_at(store, auth_token, offset):
+    """Check whether the store has an item at the given offset"""
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
     
-    # Process batches of items
-    start_index = 0
-    while True:
-        # Get a batch of items from source store
-        items = get_item_batch(store1, auth_token1, start_index, batch_size)
-        
-        # Check if we've reached the end of the items
-        if not items:
-            break
-            
-        # Check if this is an onprem store
-        is_onprem = not "." in store2 or ":" in store2
-        
-        if is_onprem:
-            url = endpoint_handler.get_full_url("store2", "/api/public/core/v1/items")
-            headers = endpoint_handler.get_headers("store2")
-            response = requests.patch(url, headers=headers, json=items, timeout=120)
-        else:
-            response = requests.patch(
-                f"https://{store2}.pcm.pricer-plaza.com/api/public/core/v1/items",
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {auth_token2}",
-                    "Content-Type": "application/json"
-                },
-                json=items,
-                timeout=120
-            )
-        if response.status_code in [200, 201, 202]:
-            request_id = response.json().get("requestId")
-            request_ids.append(request_id)
-            write_log(f"Successfully uploaded {len(items)} items to {store2}. Request ID: {request_id}", "green")
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/items?projection=S&start={offset}&limit=1")
+        headers = endpoint_handler.get_headers("store1")
+        response = requests.get(url, headers=headers, timeout=60)
+    else:
+        response = requests.get(
+            f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items?projection=S&start={offset}&limit=1",
+            headers={
+                "accept": "application/json",
+                "Authorization": f"Bearer {auth_token}"
+            },
+            timeout=60
+        )
+    response.raise_for_status()
+    return len(response.json()) > 0
+
+def find_item_count(store, auth_token, start_index=0, step=1000):
+    """
+    Find the number of items on the store with single-item probes,
+    doubling the probe offset until it is past the end and then bisecting
+    """
+    if not has_item_at(store, auth_token, start_index):
+        return start_index
+    
+    low, high = start_index, start_index + step
+    while has_item_at(store, auth_token, high):
+        low = high
+        step *= 2
+        high = low + step
+    
+    while high - low > 1:
+        middle = (low + high) // 2
+        if has_item_at(store, auth_token, middle):
+            low = middle
         else:
-            write_log(f"Failed to upload batch starting at index {start_index}. Status: {response.status_code}", "red")
+            high = middle
+    return low + 1
+
+def read_parallel_batches(fetch_batch, store, auth_token, batch_size=1000, workers=4, ordered=True, max_batches_in_flight=4, start_index=0):
+    """
+    Split the item offsets of the source store into ranges and fetch them with several workers,
+    yielding (start_index, limit, items) tuples like read_ahead_batches.
+    The end of the data is found by probing first. Batches are yielded in offset order when
+    ordered is set, otherwise as soon as they arrive.
+    Raises an exception if a batch before the end of the data cannot be fetched or comes back empty.
+    At most workers + max_batches_in_flight batches are requested or held at any time.
+    Like read_ahead_batches, an AdaptiveBatchSize is read again before each range is fetched.
+    """
+    try:
+        item_count = find_item_count(store, auth_token, start_index)
+    except Exception as e:
+        write_log(f"Could not find the number of items on {store}, reading sequentially: {str(e)}", "yellow")
+        yield from read_ahead_batches(fetch_batch, store, auth_token, batch_size, max_batches_in_flight, start_index)
+        return
+    write_log(f"Found {item_count - start_index} items to read from {store}, reading with {workers} workers", "cyan")
+    
+    next_offset = start_index
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    
+    def submit_next():
+        nonlocal next_offset
+        if next_offset >= item_count:
             return False
-            
-        total_items += len(items)
+        limit = batch_size.size if isinstance(batch_size, AdaptiveBatchSize) else batch_size
+        pending.append((next_offset, limit, executor.submit(fetch_batch, store, auth_token, next_offset, limit)))
+        next_offset += limit
+        return True
+    
+    try:
+        while len(pending) < workers + max_batches_in_flight and submit_next():
+            pass
         
-        # If we got less than the batch size, we've reached the end
-        if len(items) < batch_size:
-            break
+        while pending:
+            if ordered:
+                offset, limit, future = pending.popleft()
+            else:
+                done, _ = wait([future for _, _, future in pending], return_when=FIRST_COMPLETED)
+                offset, limit, future = next(entry for entry in pending if entry[2] in done)
+                pending.remove((offset, limit, future))
             
-        # Move to next batch
-        start_index += batch_size
-        
-        # Short pause to avoid overloading the API
-        time.sleep(1)
+            items = future.result()
+            if items is None:
+                raise RuntimeError(f"Could not fetch the batch starting at index {offset} from {store}")
+            if batch_length(items) == 0:
+                # The probe found items there, an empty batch means the read went wrong
+                raise RuntimeError(f"No items returned for the batch starting at index {offset} of {store}")
+            submit_next()
+            yield offset, limit, items
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
-    # Add an initial wait before checking request statuses
-    if request_ids:
-        write_log(f"Waiting 15 seconds before checking request statuses...", "cyan")
-        time.sleep(15)
+    # Pick up items added to the source while it was being read
+    yield from read_ahead_batches(fetch_batch, store, auth_token, batch_size, max_batches_in_flight, item_count)
+
+def send_item_batch(store, auth_token, items, timeout=120, compress=None):
+    """
+    PATCH a batch of items to the target store and return the response.
+    items is either a list of items or an encoded JSON body, which is sent as is.
+    compress ("gzip" or "zstd") compresses the request body.
+    """
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
     
-    # Now check all request IDs for status and errors
-    success_count = 0
-    for request_id in request_ids:
-        write_log(f"Checking upload status for request ID: {request_id}", "cyan")
-        if check_request_status(store2, auth_token2, request_id, max_retries=6, retry_interval=10):
-            success_count += 1
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store2", "/api/public/core/v1/items")
+        headers = endpoint_handler.get_headers("store2")
+        headers["Content-Type"] = "application/json"
+    else:
+        url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items"
+        headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {auth_token}",
+            "Content-Type": "application/json"
+        }
     
-    write_log(f"Item migration complete! Migrated {total_items} items from {store1} to {store2}", "green")
-    write_log(f"Upload status summary: {success_count}/{len(request_ids)} batches completed successfully", "green" if success_count == len(request_ids) else "yellow")
-    return success_count == len(request_ids)
+    body = items if isinstance(items, bytes) else json.dumps(items).encode()
+    return patch_json(store, url, headers, body, timeout, compress)
 
-def migrate_linked_items(store1, store2, auth_token1, auth_token2):
-    """Migrate linked items from store1 to store2"""
-    write_log(f"Starting linked item migration from {store1} to {store2}", "cyan")
+def upload_item_batch(store, auth_token, items, batch_size, description, size=None, compress=None, quarantine=None):
+    """
+    Upload a batch of items, splitting it into smaller batches when the target times out,
+    rejects the payload size or fails with a server error.
+    With a QuarantineFile, a batch the target rejects for its content (400 or 422) is bisected
+    down to the items causing the rejection, which are quarantined while the others are uploaded.
+    Other refusals such as 401, 403 or 404 apply to every batch and fail the upload.
+    A decoded batch larger than the current batch size is split before it is sent.
+    size is the number of items in a raw batch, which is only decoded if it has to be split.
+    Returns a list of (request_id, items) tuples, or None if the batch could not be uploaded.
+    """
+    if not isinstance(items, bytes) and len(items) > batch_size.size:
+        # Read before the batch size was last lowered, send it in batches of the current size
+        uploads = []
+        for i in range(0, len(items), batch_size.size):
+            chunk_uploads = upload_item_batch(store, auth_token, items[i:i+batch_size.size], batch_size, description, compress=compress, quarantine=quarantine)
+            if chunk_uploads is None:
+                return None
+            uploads.extend(chunk_uploads)
+        return uploads
+    
+    body = items if isinstance(items, bytes) else json.dumps(items).encode()
+    size = batch_length(items) or size or 1
+    
+    start_time = time.monotonic()
+    try:
+        response = send_item_batch(store, auth_token, body, compress=compress)
+        status_code = response.status_code
+    except requests.exceptions.Timeout:
+        response, status_code = None, None
+    elapsed = time.monotonic() - start_time
+    
+    if status_code in [200, 201, 202]:
+        batch_size.record_success(size, elapsed, len(body))
+        request_id = response.json().get("requestId")
+        write_log(f"Successfully uploaded {size} {description} ({len(body)} bytes) to {store} in {elapsed:.1f}s. Request ID: {request_id}", "green")
+        return [(request_id, items)]
+    
+    if quarantine and status_code in [400, 422]:
+        # Rejected content, narrow it down to the bad items
+        if isinstance(items, bytes):
+            items = json.loads(items)
+        if len(items) == 1:
+            quarantine.add(items[0], f"Rejected with status {status_code}: {response.text[:500]}")
+            return []
+        middle = len(items) // 2
+        write_log(f"Batch of {len(items)} {description} rejected with status {status_code}, splitting it in two", "yellow")
+        uploads = []
+        for half in [items[:middle], items[middle:]]:
+            half_uploads = upload_item_batch(store, auth_token, half, batch_size, description, compress=compress, quarantine=quarantine)
+            if half_uploads is None:
+                return None
+            uploads.extend(half_uploads)
+        return uploads
+    
+    if not batch_size.is_retryable(status_code) or size <= batch_size.min_size:
+        write_log(f"Failed to upload batch of {size} {description}. Status: {status_code or 'timeout'}", "red")
+        return None
+    
+    # Retry the same items in smaller batches
+    batch_size.record_failure(size, status_code)
+    if isinstance(items, bytes):
+        items = json.loads(items)
+    chunk_size = max(min(batch_size.size, (len(items) + 1) // 2), batch_size.min_size)
+    uploads = []
+    for i in range(0, len(items), chunk_size):
+        chunk_uploads = upload_item_batch(store, auth_token, items[i:i+chunk_size], batch_size, description, compress=compress, quarantine=quarantine)
+        if chunk_uploads is None:
+            return None
+        uploads.extend(chunk_uploads)
+    return uploads
+
+def verify_item_index(store, auth_token, index):
+    """Rebuild the delta index from a fresh read of the items on the target store"""
+    write_log(f"Verifying item index against the items on {store}", "cyan")
+    try:
+        index.rebuild(items for _, _, items in read_ahead_batches(get_item_batch, store, auth_token))
+    except Exception as e:
+        # The items missing from the index are uploaded again, nothing is lost
+        write_log(f"Could not read all the items on {store}, the item index is incomplete: {str(e)}", "yellow")
+
+def migrate_item_batches(store1, store2, auth_token1, auth_token2, fetch_batch, description, batch_size, max_batches_in_flight=4, index=None, journal=None, compress=None, read_workers=1, ordered=True, quarantine=None, paged=False, max_requests_in_flight=16):
+    """
+    Copy batches returned by fetch_batch from store1 to store2.
+    Source reads run ahead of target uploads, bounded by max_batches_in_flight.
+    batch_size is an AdaptiveBatchSize, tuned from the upload latency.
+    With an ItemHashIndex, only new or changed items are uploaded and the index is
+    updated once the target reports them as processed.
+    With a MigrationJournal, the migration resumes after the last accepted batch of an
+    interrupted run, and the requests that run left in flight are polled again.
+    compress ("gzip" or "zstd") compresses the upload request bodies.
+    With read_workers above 1, fetch_batch must page by offset and the source is read in
+    parallel ranges, in order unless ordered is False (a journal always needs ordered reads).
+    With a QuarantineFile, rejected batches are bisected down to the bad items, and items that
+    items-result reports as failed are re-submitted once on their own before being quarantined.
+    Their items are kept until the target has processed them, so at most max_requests_in_flight
+    requests are left unprocessed before the next batch is uploaded.
+    With paged, fetch_batch takes a page number, which is also what the journal records.
+    """
     total_items = 0
-    batch_size = 1000
+    skipped_items = 0
     request_ids = []
+    success = True
+    logged_unknown_properties = set()  # Track properties with unknown property errors
+    completed = []
+    uploaded_hashes = {}  # Hashes of the items carried by each request, for the index
+    uploaded_items = {}  # Items carried by each request, kept until the request finishes to re-submit failures
+    resubmitted = set()  # Requests that re-submit items which already failed once
+    resubmissions = queue.Queue()  # Failed items waiting to be re-submitted from the upload loop
     
-    # Process batches of items
-    start_index = 0
-    while True:
-        # Get a batch of linked items from source store
-        items = get_linked_item_batch(store1, auth_token1, start_index, batch_size)
-        
-        # Check if we've reached the end of the items
-        if not items:
-            break
-            
-        # Check if this is an onprem store
-        is_onprem = not "." in store2 or ":" in store2
-        
-        if is_onprem:
-            url = endpoint_handler.get_full_url("store2", "/api/public/core/v1/items")
-            headers = endpoint_handler.get_headers("store2")
-            response = requests.patch(url, headers=headers, json=items, timeout=120)
-        else:
-            response = requests.patch(
-                f"https://{store2}.pcm.pricer-plaza.com/api/public/core/v1/items",
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {auth_token2}",
-                    "Content-Type": "application/json"
-                },
-                json=items,
-                timeout=120
-            )
-        if response.status_code in [200, 201, 202]:
-            request_id = response.json().get("requestId")
+    def track_uploads(uploads, hashes=None):
+        for request_id, sent_items in uploads:
+            if hashes is not None:
+                uploaded_hashes[request_id] = {item.get("itemId"): hashes[item.get("itemId")] for item in sent_items}
+            if quarantine:
+                uploaded_items[request_id] = sent_items
             request_ids.append(request_id)
-            write_log(f"Successfully uploaded {len(items)} linked items to {store2}. Request ID: {request_id}", "green")
-        else:
-            write_log(f"Failed to upload batch starting at index {start_index}. Status: {response.status_code}", "red")
-            return False
-            
-        total_items += len(items)
+            poller.add(request_id)
+    
+    def resubmit_failed_items(request_id, result, sent_items, failed_ids, hashes):
+        if isinstance(sent_items, bytes):
+            sent_items = json.loads(sent_items)
+        failed_items = [item for item in sent_items if item.get("itemId") in failed_ids]
         
-        # If we got less than the batch size, we've reached the end
-        if len(items) < batch_size:
-            break
-            
-        # Move to next batch
-        start_index += batch_size
+        if request_id in resubmitted:
+            errors = {item_result.get("itemId"): item_result.get("errors") or item_result.get("status") for item_result in result.get("itemResults") or [] if item_result}
+            for item in failed_items:
+                quarantine.add(item, f"Failed twice in items-result: {json.dumps(errors.get(item.get('itemId')))}")
+            return
         
-        # Short pause to avoid overloading the API
-        time.sleep(1)
+        write_log(f"Re-submitting {len(failed_items)} failed {description} from request {request_id}", "yellow")
+        uploads = upload_item_batch(store2, auth_token2, failed_items, batch_size, description, compress=compress, quarantine=quarantine)
+        if uploads is None:
+            for item in failed_items:
+                quarantine.add(item, "Could not be re-submitted")
+            return
+        for new_request_id, _ in uploads:
+            resubmitted.add(new_request_id)
+            if journal:
+                journal.record_request(new_request_id)
+        track_uploads(uploads, hashes)
     
-    # Add an initial wait before checking request statuses
-    if request_ids:
-        write_log(f"Waiting 15 seconds before checking request statuses...", "cyan")
-        time.sleep(15)
+    def resubmit_queued_items():
+        while True:
+            try:
+                queued = resubmissions.get_nowait()
+            except queue.Empty:
+                return
+            resubmit_failed_items(*queued)
+    
+    def on_complete(request_id, result):
+        hashes = uploaded_hashes.pop(request_id, None)
+        sent_items = uploaded_items.pop(request_id, None)
+        if journal:
+            # Timed out and unknown requests are not polled again by later runs either
+            journal.record_completed(request_id)
+        if not report_items_result(request_id, result, logged_unknown_properties):
+            return
+        completed.append(request_id)
+        failed_ids = set(failed_item_ids(result))
+        if index and hashes:
+            index.mark_uploaded({item_id: hash_value for item_id, hash_value in hashes.items() if item_id not in failed_ids})
+        if quarantine and failed_ids and sent_items is not None:
+            # Uploading here would hold up the polling thread
+            resubmissions.put((request_id, result, sent_items, failed_ids, hashes))
+    
+    # Upload statuses are polled in the background while the next batches are uploaded
+    poller = RequestPoller(lambda request_id: get_items_result(store2, auth_token2, request_id), on_complete)
+    poller.start()
     
-    # Now check all request IDs for status and errors
-    success_count = 0
-    for request_id in request_ids:
-        write_log(f"Checking upload status for request ID: {request_id}", "cyan")
-        if check_request_status(store2, auth_token2, request_id, max_retries=6, retry_interval=10):
-            success_count += 1
+    first_index = 0
+    if journal:
+        first_index = journal.next_start
+        request_ids.extend(journal.outstanding)
+        if first_index or request_ids:
+            write_log(f"Resuming {description} migration at {'page' if paged else 'index'} {first_index}, checking {len(request_ids)} requests left in progress", "yellow")
+        for request_id in request_ids:
+            poller.add(request_id)
+    
+    if read_workers > 1:
+        batches = read_parallel_batches(fetch_batch, store1, auth_token1, batch_size, read_workers, ordered or journal is not None, max_batches_in_flight, first_index)
+    else:
+        batches = read_ahead_batches(fetch_batch, store1, auth_token1, batch_size, max_batches_in_flight, first_index, paged)
+    
+    try:
+        for start_index, limit, items in batches:
+            resubmit_queued_items()
+            next_start = start_index + (1 if paged else limit)
+            if index:
+                fetched_count = len(items)
+                items, hashes = index.changed_items(items)
+                skipped_items += fetched_count - len(items)
+                if not items:
+                    write_log(f"Skipping batch starting at index {start_index}, all {fetched_count} {description} unchanged", "cyan")
+                    if journal:
+                        journal.record_batch(next_start, [])
+                    continue
+            
+            if quarantine:
+                # Bound the uploaded items kept for re-submission
+                poller.wait_for_room(max_requests_in_flight)
+            uploads = upload_item_batch(store2, auth_token2, items, batch_size, description, size=limit, compress=compress, quarantine=quarantine)
+            if uploads is None:
+                write_log(f"Failed to upload batch starting at index {start_index}", "red")
+                success = False
+                break
+            if journal:
+                journal.record_batch(next_start, [request_id for request_id, _ in uploads])
+            track_uploads(uploads, hashes if index else None)
+            total_items += len(items)
+    except Exception as e:
+        # A failed read must not look like the end of the source, the journal keeps the position
+        write_log(f"Stopped reading {description} from {store1}: {str(e)}", "red")
+        success = False
+    
+    batch_size.report()
+    report_wire_bytes(store2)
+    if index:
+        write_log(f"Skipped {skipped_items} unchanged {description}", "cyan")
+    
+    # Wait for the remaining upload statuses, re-submissions add new requests to follow
+    if request_ids:
+        write_log(f"Checking upload status of {len(request_ids)} requests", "cyan")
+    poller.wait_idle()
+    while not resubmissions.empty():
+        resubmit_queued_items()
+        poller.wait_idle()
+    poller.wait()
+    success_count = len(completed)
+    if quarantine:
+        quarantine.report()
     
-    write_log(f"Linked item migration complete! Migrated {total_items} linked items from {store1} to {store2}", "green")
     write_log(f"Upload status summary: {success_count}/{len(request_ids)} batches completed successfully", "green" if success_count == len(request_ids) else "yellow")
-    return success_count == len(request_ids)
\ No newline at end of file
+    if journal and success and not journal.outstanding:
+        journal.finish()
+    return success and success_count == len(request_ids), total_items, request_ids
+
+def migrate_items(store1, store2, auth_token1, auth_token2, batch_size=1000, min_batch_size=250, max_batch_size=5000, max_batches_in_flight=4, passthrough=False, delta=False, verify_index=False, index_path="item_index.sqlite", resume=True, journal_path="migration_journal.json", compress=None, read_workers=4, ordered=True, quarantine_path="quarantine_items.jsonl"):
+    """
+    Migrate all items from store1 to store2
+    The batch size starts at batch_size and is tuned within [min_batch_size, max_batch_size].
+    With passthrough, source response bodies are forwarded to the target without being decoded,
+    so the migrated amount is reported in bytes instead of items.
+    With delta, only items that are new or changed since the last run are uploaded, based on
+    a local index of what store2 received. verify_index rebuilds that index from store2 first.
+    With resume, an interrupted migration continues from its last accepted batch.
+    compress ("gzip" or "zstd") compresses the upload request bodies.
+    read_workers sets how many source ranges are fetched in parallel, batches reach the
+    upload side in source order unless ordered is False.
+    Items the target refuses are written to quarantine_path instead of stopping the migration.
+    """
+    write_log(f"Starting item migration from {store1} to {store2}", "cyan")
+    index = None
+    if delta:
+        # Items have to be decoded to be compared with the index
+        passthrough = False
+        index = ItemHashIndex(store2, index_path)
+        if verify_index:
+            verify_item_index(store2, auth_token2, index)
+        write_log(f"Delta mode: {index.count()} items already known on {store2}", "cyan")
+    
+    fetch_batch = get_item_batch_raw if passthrough else get_item_batch
+    try:
+        success, total_items, _ = migrate_item_batches(
+            store1, store2, auth_token1, auth_token2, fetch_batch, "items",
+            get_batch_size(store2, "items", batch_size, min_batch_size, max_batch_size),
+            max_batches_in_flight=max_batches_in_flight, index=index,
+            journal=MigrationJournal("items", store1, store2, journal_path) if resume else None,
+            compress=compress, read_workers=read_workers, ordered=ordered,
+            quarantine=QuarantineFile(store1, store2, quarantine_path)
+        )
+    finally:
+        if index:
+            index.close()
+    migrated = f"{total_items} bytes of items" if passthrough else f"{total_items} items"
+    write_log(f"Item migration complete! Migrated {migrated} from {store1} to {store2}", "green" if success else "yellow")
+    return success
+
+def migrate_linked_items(store1, store2, auth_token1, auth_token2, batch_size=1000, max_batches_in_flight=4, resume=True, journal_path="migration_journal.json", compress=None, quarantine_path="quarantine_items.jsonl"):
+    """
+    Migrate linked items from store1 to store2
+    The search API pages by page number, so the batch size is kept fixed.
+    With resume, an interrupted migration continues from its last accepted batch.
+    compress ("gzip" or "zstd") compresses the upload request bodies.
+    Items the target refuses are written to quarantine_path instead of stopping the migration.
+    """
+    write_log(f"Starting linked item migration from {store1} to {store2}", "cyan")
+    success, total_items, _ = migrate_item_batches(
+        store1, store2, auth_token1, auth_token2, get_linked_item_batch, "linked items",
+        AdaptiveBatchSize(store2, "linked items", batch_size, batch_size, batch_size),
+        max_batches_in_flight=max_batches_in_flight,
+        journal=MigrationJournal("linked items", store1, store2, journal_path) if resume else None,
+        compress=compress, quarantine=QuarantineFile(store1, store2, quarantine_path), paged=True
+    )
+    write_log(f"Linked item migration complete! Migrated {total_items} linked items from {store1} to {store2}", "green" if success else "yellow")
+    return success
@@ -0,0 +1,96 @@
+from common import write_log
+from endpoint_handler import endpoint_handler
+from items import read_parallel_batches
+from infrastructure import get_link_departments
+from collections import Counter
+import requests
+
+def get_item_id_batch(store, auth_token, start=0, limit=1000):
+    """Fetch the IDs of a batch of items from the store, raises an exception on failure"""
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
+
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store2", f"/api/public/core/v1/items?projection=S&start={start}&limit={limit}")
+        headers = endpoint_handler.get_headers("store2")
+        response = requests.get(url, headers=headers, timeout=60)
+    else:
+        response = requests.get(
+            f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/items?projection=S&start={start}&limit={limit}",
+            headers={
+                "accept": "application/json",
+                "Authorization": f"Bearer {auth_token}"
+            },
+            timeout=60
+        )
+    response.raise_for_status()
+    return [item.get("itemId") for item in response.json()]
+
+class LinkValidator:
+    """
+    In-memory index of the item IDs and link departments of a target store, used to
+    check labels before they are uploaded so invalid links never reach the labels API.
+    """
+    def __init__(self, store, auth_token):
+        self.store = store
+        self.auth_token = auth_token
+        self.item_ids = None  # None when the target items could not be indexed
+        self.link_departments = None  # IDs and aliases, None when they could not be read
+        self.errors = Counter()
+
+    def load(self, read_workers=4):
+        """Read the item IDs and link departments of the target store"""
+        try:
+            item_ids = set()
+            for _, _, ids in read_parallel_batches(get_item_id_batch, self.store, self.auth_token, workers=read_workers, ordered=False):
+                item_ids.update(ids)
+            if item_ids:
+                self.item_ids = item_ids
+                write_log(f"Indexed {len(item_ids)} item IDs on {self.store}", "green")
+            else:
+                write_log(f"No items found on {self.store}, links are not checked against items", "yellow")
+        except Exception as e:
+            write_log(f"Could not index the items on {self.store}, links are not checked against items: {str(e)}", "yellow")
+
+        try:
+            departments = get_link_departments(self.store, self.auth_token)
+            if not isinstance(departments, list):
+                raise ValueError(f"unexpected response {str(departments)[:200]}")
+            link_departments = set()
+            for department in departments:
+                link_departments.add(department.get("id"))
+                if department.get("alias"):
+                    link_departments.add(department.get("alias"))
+            self.link_departments = link_departments
+            write_log(f"Indexed {len(departments)} link departments on {self.store}", "green")
+        except Exception as e:
+            write_log(f"Could not read the link departments of {self.store}, links are not checked against them: {str(e)}", "yellow")
+
+    def check(self, label):
+        """Return the reason the label would be refused by the target, or None if it looks valid"""
+        if self.link_departments is not None and not label.get("homeTrx"):
+            # homeTrx has priority over the link department when it is set
+            if not self.link_departments:
+                return "ERROR_NO_LINK_DEPARTMENTS"
+            if label.get("linkDepartment") and label["linkDepartment"] not in self.link_departments:
+                return f"ERROR_UNKNOWN_LINK_DEPARTMENT: {label['linkDepartment']}"
+
+        if self.item_ids is not None:
+            missing = [link["itemId"] for link in label.get("links", []) if link.get("itemId") and link["itemId"] not in self.item_ids]
+            if missing:
+                return f"ERROR_UNKNOWN_ITEM: {', '.join(missing)}"
+        return None
+
+    def filter(self, labels, quarantine):
+        """Yield the labels that look valid and write the others to the quarantine file"""
+        for label in labels:
+            reason = self.check(label)
+            if reason is None:
+                yield label
+            else:
+                self.errors[reason.split(":")[0]] += 1
+                quarantine.add(label, reason)
+
+    def report(self):
+        for error_type, count in self.errors.items():
+            write_log(f"Not uploaded, {error_type}: {count}", "red")
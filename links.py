@@ -1,67 +1,188 @@
 import requests
 import json
 import time
+import itertools
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from common import write_log
 from tqdm import tqdm
 from collections import defaultdict
+from urllib.parse import urlencode
 from endpoint_handler import endpoint_handler
+from request_poller import RequestPoller
+from batch_sizing import get_batch_size
+from http_compression import accept_encoding, patch_json, report_wire_bytes
+from link_validation import LinkValidator
+from quarantine import QuarantineFile
+from streaming import iter_from_threads
 
-def get_links(store, auth_token, batch_size=20000):
+def iter_link_pages(store, auth_token, batch_size=20000, min_batch_size=1000, filters=None):
     """
-    Get all links from the specified store using the labels API
-    with support for pagination to handle large datasets
+    Yield the links of the specified store page by page using the labels API,
+    so only one page is held in memory at a time.
+    The page size is tuned between min_batch_size and batch_size from the measured latency.
+    filters restricts the labels read, e.g. {"modelName": "SmartTAG HD Fruits"}.
+    Raises an exception if a page cannot be fetched.
     """
-    write_log(f"Fetching links from {store}...", "cyan")
-    all_links = []
+    filter_query = "".join(f"&{urlencode({f'filter[{name}]': value})}" for name, value in (filters or {}).items())
+    shard = f" ({', '.join(str(value) for value in filters.values())})" if filters else ""
+    write_log(f"Fetching links from {store}{shard}...", "cyan")
+    total_links = 0
     start = 0
+    page_size = get_batch_size(store, "label reads", batch_size, min_batch_size, batch_size)
     
-    try:
-        # Check if this is an onprem store
-        is_onprem = not "." in store or ":" in store
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
+    
+    while True:
+        limit = page_size.size
+        if is_onprem:
+            url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/labels?projection=M&start={start}&limit={limit}&serializeDatesToIso8601=true{filter_query}")
+            headers = endpoint_handler.get_headers("store1")
+            headers["Accept-Encoding"] = accept_encoding()
+        else:
+            url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/labels?projection=M&start={start}&limit={limit}&serializeDatesToIso8601=true{filter_query}"
+            headers = {
+                "accept": "application/json",
+                "Accept-Encoding": accept_encoding(),
+                "Authorization": f"Bearer {auth_token}"
+            }
         
-        while True:
-            if is_onprem:
-                url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/labels?projection=M&start={start}&limit={batch_size}&serializeDatesToIso8601=true")
-                headers = endpoint_handler.get_headers("store1")
-                response = requests.get(url, headers=headers)
-            else:
-                url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/labels?projection=M&start={start}&limit={batch_size}&serializeDatesToIso8601=true"
-                headers = {
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {auth_token}"
-                }
-                response = requests.get(url, headers=headers)
-            
-            if response.status_code != 200:
-                write_log(f"Failed to get links: {response.status_code} - {response.text}", "red")
-                return None
-            
-            batch_data = response.json()
-            batch_count = len(batch_data)
-            all_links.extend(batch_data)
-            
-            write_log(f"Fetched batch of {batch_count} links (total so far: {len(all_links)})", "cyan")
-            
-            # If we got fewer results than the batch size, we've reached the end
-            if batch_count < batch_size:
-                break
-                
-            start += batch_size
-            # Small delay to prevent rate limiting
-            time.sleep(0.5)
+        start_time = time.monotonic()
+        try:
+            response = requests.get(url, headers=headers, timeout=120)
+            status_code = response.status_code
+        except requests.exceptions.Timeout:
+            response, status_code = None, None
+        elapsed = time.monotonic() - start_time
+        
+        if status_code != 200:
+            if page_size.is_retryable(status_code) and limit > page_size.min_size:
+                # Retry the same page with a smaller page size
+                page_size.record_failure(limit, status_code)
+                continue
+            raise RuntimeError(f"Failed to get links: {status_code or 'timeout'} - {response.text if response is not None else ''}")
+        
+        page_size.record_success(limit, elapsed, len(response.content))
+        batch_data = response.json()
+        batch_count = len(batch_data)
+        total_links += batch_count
+        
+        write_log(f"Fetched batch of {batch_count} links{shard} (total so far: {total_links})", "cyan")
+        yield batch_data
         
-        write_log(f"Successfully fetched {len(all_links)} links from {store}", "green")
-        return all_links
+        # If we got fewer results than the batch size, we've reached the end
+        if batch_count < limit:
+            break
+            
+        start += limit
+        # Small delay to prevent rate limiting
+        time.sleep(0.5)
     
+    write_log(f"Successfully fetched {total_links} links from {store}{shard}", "green")
+    page_size.report()
+
+def get_links(store, auth_token, batch_size=20000, min_batch_size=1000):
+    """
+    Get all links from the specified store using the labels API
+    with support for pagination to handle large datasets
+    """
+    try:
+        return [link for page in iter_link_pages(store, auth_token, batch_size, min_batch_size) for link in page]
     except Exception as e:
         write_log(f"Error getting links: {str(e)}", "red")
         return None
 
-def check_request_status(store, auth_token, request_id, max_attempts=10, wait_time=60, initial_wait=15):
+def get_label_models(store, auth_token):
+    """Get the label models of the store with their number of linked labels"""
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
+    
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store1", "/api/public/core/v1/labels/models")
+        headers = endpoint_handler.get_headers("store1")
+    else:
+        url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/labels/models"
+        headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {auth_token}"
+        }
+    
+    response = requests.get(url, headers=headers, timeout=60)
+    response.raise_for_status()
+    return response.json().get("models", [])
+
+def has_label_at(store, auth_token, offset):
+    """Check whether the store has a label at the given offset"""
+    # Check if this is an onprem store
+    is_onprem = not "." in store or ":" in store
+    
+    if is_onprem:
+        url = endpoint_handler.get_full_url("store1", f"/api/public/core/v1/labels?projection=S&start={offset}&limit=1")
+        headers = endpoint_handler.get_headers("store1")
+    else:
+        url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/labels?projection=S&start={offset}&limit=1"
+        headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {auth_token}"
+        }
+    
+    response = requests.get(url, headers=headers, timeout=60)
+    response.raise_for_status()
+    return len(response.json()) > 0
+
+def iter_sharded_link_pages(store, auth_token, model_names=None, workers=4, max_pages_in_flight=4, batch_size=20000, min_batch_size=1000):
     """
-    Check the status of a request using the labels-result API
-    Returns a tuple (success, error_summary)
-    Treats IN_PROGRESS as COMPLETED and ignores PENDING items in results.
+    Yield the links of the store page by page, reading one shard per label model
+    (filter[modelName]) with several workers and merging the pages as they arrive.
+    model_names limits the read to the models whose name starts with one of the given
+    names, e.g. ["SmartTAG HD"] for one model family.
+    Without model_names, labels outside the listed models are picked up by a final full read.
+    At most max_pages_in_flight fetched pages are held in memory at any time.
+    Raises an exception if a page cannot be fetched.
+    """
+    try:
+        models = get_label_models(store, auth_token)
+    except Exception as e:
+        if model_names:
+            raise RuntimeError(f"Could not list the label models of {store}: {str(e)}")
+        write_log(f"Could not list the label models of {store}, reading links sequentially: {str(e)}", "yellow")
+        yield from iter_link_pages(store, auth_token, batch_size, min_batch_size)
+        return
+    
+    shards = [model["name"] for model in models if model.get("name") and (not model_names or any(model["name"].startswith(name) for name in model_names))]
+    # Start the largest shards first so they do not end up running alone at the end
+    counts = {model.get("name"): model.get("numberOfLinkedLabels") or 0 for model in models}
+    shards.sort(key=lambda name: counts.get(name, 0), reverse=True)
+    write_log(f"Reading links from {store} in {len(shards)} model shards with {workers} workers", "cyan")
+    
+    def read_shard(model_name, put):
+        for page in iter_link_pages(store, auth_token, batch_size, min_batch_size, filters={"modelName": model_name}):
+            if not put(page):
+                return
+    
+    total_links = 0
+    shard_readers = [lambda put, model_name=model_name: read_shard(model_name, put) for model_name in shards]
+    for page in iter_from_threads(shard_readers, max_pages_in_flight, workers):
+        total_links += len(page)
+        yield page
+    
+    write_log(f"Fetched {total_links} links from {len(shards)} model shards of {store}", "green")
+    
+    # Labels with a model that was not listed are read again without a filter and picked out
+    if not model_names and has_label_at(store, auth_token, total_links):
+        write_log(f"{store} has labels outside the listed models, reading them with a full pass", "yellow")
+        sharded_models = set(shards)
+        for page in iter_link_pages(store, auth_token, batch_size, min_batch_size):
+            remainder = [link for link in page if link.get("modelName") not in sharded_models]
+            if remainder:
+                yield remainder
+
+def get_labels_result(store, auth_token, request_id):
+    """
+    Fetch the labels-result of a link request, returns (finished, result)
+    Treats IN_PROGRESS as COMPLETED, PENDING items are ignored when summarizing.
     """
     # Check if this is an onprem store
     is_onprem = not "." in store or ":" in store
@@ -76,90 +197,111 @@ def check_request_status(store, auth_token, request_id, max_attempts=10, wait_ti
             "Authorization": f"Bearer {auth_token}"
         }
     
+    response = requests.get(url, headers=headers, timeout=60)
+    # Errors are raised for the poller, which gives up on 4xx and checks again later otherwise
+    response.raise_for_status()
+    
+    result = response.json()
+    return (result.get("status") in ["COMPLETED", "IN_PROGRESS", "FAILED"], result)
+
+def summarize_labels_result(request_id, result):
+    """
+    Summarize a finished labels-result
+    Returns a tuple (success, error_summary)
+    """
     # Store detailed error information
     error_summary = defaultdict(list)
     
-    # Wait initially before checking status
-    write_log(f"Waiting {initial_wait} seconds before first status check...", "cyan")
-    time.sleep(initial_wait)
+    if result is None:
+        write_log(f"Request {request_id} status check timed out", "red")
+        return (False, error_summary)
     
-    for attempt in range(max_attempts):
-        try:
-            write_log(f"Checking request status (attempt {attempt+1}/{max_attempts}), request ID: {request_id}", "cyan")
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                # Extract overall status
-                status = result.get("status")
-                
-                # Only log if status is different from PENDING
-                if status != "PENDING":
-                    write_log(f"Request status: {status}", "cyan")
-                
-                # Check if processing is complete or in progress (treat IN_PROGRESS as COMPLETED)
-                if status in ["COMPLETED", "IN_PROGRESS"]:
-                    # Process item results for detailed reporting
-                    if "results" in result:
-                        error_count = 0
-                        success_count = 0
-                        pending_count = 0
-                        
-                        # Group errors by type
-                        for item in result["results"]:
-                            item_status = item.get("status", "")
-                            
-                            if item_status in ["SUCCESS", "SUCCESS_NEW_ITEM"]:
-                                success_count += 1
-                            elif item_status == "PENDING":
-                                # Ignore items with PENDING status
-                                pending_count += 1
-                            else:
-                                error_count += 1
-                                # Store error details with barcode and itemId if available
-                                error_info = {}
-                                if "barcode" in item:
-                                    error_info["barcode"] = item["barcode"]
-                                if "itemId" in item:
-                                    error_info["itemId"] = item["itemId"]
-                                
-                                error_summary[item_status].append(error_info)
-                        
-                        # Generate error summary
-                        if error_count > 0:
-                            write_log(f"Request processed with {error_count} errors, {success_count} successes, {pending_count} still pending", "yellow")
-                            return (False, error_summary)
-                        else:
-                            write_log(f"Request {request_id} processed successfully with {success_count} successes, {pending_count} still pending", "green")
-                            return (True, error_summary)
-                    else:
-                        write_log(f"Request {request_id} processed but no item results found", "yellow")
-                        return (True, error_summary)
-                    
-                elif status == "FAILED":
-                    write_log(f"Request {request_id} failed: {result.get('reason', 'Unknown reason')}", "red")
-                    return (False, error_summary)
-            else:
-                write_log(f"Failed to check request status: {response.status_code} - {response.text}", "red")
-            
-            # Wait before trying again
-            time.sleep(wait_time)
+    # Extract overall status
+    status = result.get("status")
+    write_log(f"Request {request_id} status: {status}", "cyan")
+    
+    if status == "FAILED":
+        write_log(f"Request {request_id} failed: {result.get('reason', 'Unknown reason')}", "red")
+        return (False, error_summary)
+    
+    # Process item results for detailed reporting
+    if "results" not in result:
+        write_log(f"Request {request_id} processed but no item results found", "yellow")
+        return (True, error_summary)
+    
+    error_count = 0
+    success_count = 0
+    pending_count = 0
+    
+    # Group errors by type
+    for item in result["results"]:
+        item_status = item.get("status", "")
+        
+        if item_status in ["SUCCESS", "SUCCESS_NEW_ITEM"]:
+            success_count += 1
+        elif item_status == "PENDING":
+            # Ignore items with PENDING status
+            pending_count += 1
+        else:
+            error_count += 1
+            # Store error details with barcode and itemId if available
+            error_info = {}
+            if "barcode" in item:
+                error_info["barcode"] = item["barcode"]
+            if "itemId" in item:
+                error_info["itemId"] = item["itemId"]
             
-        except Exception as e:
-            write_log(f"Error checking request status: {str(e)}", "red")
-            time.sleep(wait_time)
+            error_summary[item_status].append(error_info)
     
-    write_log(f"Request status check timed out after {max_attempts} attempts", "red")
-    return (False, error_summary)
+    # Generate error summary
+    if error_count > 0:
+        write_log(f"Request {request_id} processed with {error_count} errors, {success_count} successes, {pending_count} still pending", "yellow")
+        return (False, error_summary)
+    write_log(f"Request {request_id} processed successfully with {success_count} successes, {pending_count} still pending", "green")
+    return (True, error_summary)
 
-def upload_links(store, auth_token, links_data, batch_size=20000):
+def send_link_batch(store, url, headers, batch, upload_size, compress=None):
+    """
+    PATCH one batch of links, retrying it in smaller batches when the target times out,
+    rejects the payload size or fails with a server error.
+    Returns a list of (status_code, response, link_count) tuples, one per request sent,
+    with status_code None for a timeout.
+    """
+    body = json.dumps(batch).encode()
+    start_time = time.monotonic()
+    try:
+        response = patch_json(store, url, headers, body, 60, compress)
+        status_code = response.status_code
+    except requests.exceptions.Timeout:
+        response, status_code = None, None
+    elapsed = time.monotonic() - start_time
+    
+    if status_code in [200, 202]:
+        upload_size.record_success(len(batch), elapsed, len(body))
+    elif upload_size.is_retryable(status_code) and len(batch) > upload_size.min_size:
+        # Retry the same links in smaller batches
+        upload_size.record_failure(len(batch), status_code)
+        chunk_size = max(min(upload_size.size, (len(batch) + 1) // 2), upload_size.min_size)
+        outcomes = []
+        for i in range(0, len(batch), chunk_size):
+            outcomes.extend(send_link_batch(store, url, headers, batch[i:i+chunk_size], upload_size, compress))
+        return outcomes
+    return [(status_code, response, len(batch))]
+
+def upload_links(store, auth_token, links_data, batch_size=20000, min_batch_size=500, max_batch_size=40000, compress=None, max_in_flight=4):
     """
     Upload links to the specified store using the labels API
     with batching for more reliable uploads.
-    First uploads all batches, then checks status of all requests.
+    The batch size starts at batch_size and is tuned within [min_batch_size, max_batch_size].
+    compress ("gzip" or "zstd") compresses the request bodies.
+    links_data can be any iterable, links are pulled from it one batch at a time so a
+    generator keeps memory bounded by the batch size.
+    Up to max_in_flight batches are uploaded at the same time, and the status of accepted
+    batches is checked while the next ones are uploaded.
     """
-    write_log(f"Uploading {len(links_data)} links to {store}...", "cyan")
+    write_log(f"Uploading links to {store}...", "cyan")
+    counts = {"total": 0, "successful": 0, "failed": 0}
+    pending_links = []  # Links taken from links_data that are not uploaded yet
     
     try:
         # Check if this is an onprem store
@@ -168,6 +310,7 @@ def upload_links(store, auth_token, links_data, batch_size=20000):
         if is_onprem:
             url = endpoint_handler.get_full_url("store1", "/api/public/core/v1/labels")
             headers = endpoint_handler.get_headers("store1")
+            headers["Content-Type"] = "application/json"
         else:
             url = f"https://{store}.pcm.pricer-plaza.com/api/public/core/v1/labels"
             headers = {
@@ -177,70 +320,27 @@ def upload_links(store, auth_token, links_data, batch_size=20000):
             }
         
         # Process in batches
-        total_links = len(links_data)
-        successful_uploads = 0
-        failed_uploads = 0
         all_errors = defaultdict(list)
-        pending_requests = []
+        pending_requests = {}  # request_id -> batch info, until its status is known
+        counts_lock = threading.Lock()
+        links_iter = iter(links_data)
+        source_failed = False
         
-        # Step 1: Upload all batches first
-        write_log(f"Step 1: Uploading {len(links_data)//batch_size + (1 if len(links_data) % batch_size else 0)} batches", "cyan")
-        for i in tqdm(range(0, total_links, batch_size), desc="Uploading batches"):
-            batch = links_data[i:i+batch_size]
-            batch_number = i//batch_size + 1
-            
-            # Log batch info
-            write_log(f"Uploading batch {batch_number} ({len(batch)} links)", "cyan")
-            
-            try:
-                response = requests.patch(url, headers=headers, json=batch, timeout=60)
-                
-                if response.status_code == 200:
-                    successful_uploads += len(batch)
-                    write_log(f"Batch {batch_number} upload successful with status 200", "green")
-                elif response.status_code == 202:
-                    # Request accepted for processing
-                    response_data = response.json()
-                    request_id = response_data.get("requestId")
-                    if request_id:
-                        write_log(f"Batch {batch_number} accepted for processing with request ID: {request_id}", "yellow")
-                        pending_requests.append({
-                            "request_id": request_id,
-                            "batch_size": len(batch),
-                            "batch_number": batch_number
-                        })
-                    else:
-                        write_log(f"Batch {batch_number}: Received status 202 but no requestId in response", "red")
-                        failed_uploads += len(batch)
-                else:
-                    write_log(f"Batch {batch_number} upload failed: {response.status_code} - {response.text}", "red")
-                    failed_uploads += len(batch)
-            except Exception as batch_error:
-                write_log(f"Error uploading batch {batch_number}: {str(batch_error)}", "red")
-                failed_uploads += len(batch)
+        def on_complete(request_id, result):
+            request_info = pending_requests.pop(request_id)
+            batch_number = request_info["batch_number"]
+            batch_size = request_info["batch_size"]
+            request_success, error_summary = summarize_labels_result(request_id, result)
             
-            # Short pause between batches
-            time.sleep(1)
-        
-        # Step 2: Check status of all pending requests
-        if pending_requests:
-            write_log(f"\nStep 2: Checking status of {len(pending_requests)} pending requests", "cyan")
-            for request_info in tqdm(pending_requests, desc="Checking request statuses"):
-                request_id = request_info["request_id"]
-                batch_number = request_info["batch_number"]
-                batch_size = request_info["batch_size"]
-                
-                write_log(f"Checking status of batch {batch_number} (request ID: {request_id})", "cyan")
-                request_success, error_summary = check_request_status(store, auth_token, request_id)
-                
+            with counts_lock:
                 if request_success:
-                    successful_uploads += batch_size
+                    counts["successful"] += batch_size
                     write_log(f"Batch {batch_number} processing completed successfully", "green")
                 else:
                     # Count failed items based on error summary
                     error_count = sum(len(items) for items in error_summary.values())
-                    failed_uploads += error_count
-                    successful_uploads += (batch_size - error_count)
+                    counts["failed"] += error_count
+                    counts["successful"] += (batch_size - error_count)
                     
                     # Merge the error summaries across batches
                     for error_type, items in error_summary.items():
@@ -248,6 +348,88 @@ def upload_links(store, auth_token, links_data, batch_size=20000):
                         
                     write_log(f"Batch {batch_number} processing completed with {error_count} errors", "yellow")
         
+        # Statuses are checked in the background while batches are being uploaded
+        poller = RequestPoller(lambda request_id: get_labels_result(store, auth_token, request_id), on_complete)
+        poller.start()
+        
+        upload_size = get_batch_size(store, "labels", batch_size, min_batch_size, max_batch_size)
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        progress = tqdm(desc="Uploading links", unit=" links")
+        
+        def upload_batch(batch_number, batch):
+            try:
+                outcomes = send_link_batch(store, url, headers, batch, upload_size, compress)
+            except Exception as batch_error:
+                write_log(f"Error uploading batch {batch_number}: {str(batch_error)}", "red")
+                outcomes = [(None, batch_error, len(batch))]
+            finally:
+                in_flight.release()
+            
+            for status_code, response, link_count in outcomes:
+                if isinstance(response, Exception):
+                    with counts_lock:
+                        counts["failed"] += link_count
+                elif status_code is None:
+                    write_log(f"Batch {batch_number} upload timed out", "red")
+                    with counts_lock:
+                        counts["failed"] += link_count
+                elif status_code == 200:
+                    write_log(f"Batch {batch_number} upload successful with status 200", "green")
+                    with counts_lock:
+                        counts["successful"] += link_count
+                elif status_code == 202:
+                    # Request accepted for processing
+                    request_id = response.json().get("requestId")
+                    if request_id:
+                        write_log(f"Batch {batch_number} accepted for processing with request ID: {request_id}", "yellow")
+                        pending_requests[request_id] = {
+                            "batch_size": link_count,
+                            "batch_number": batch_number
+                        }
+                        poller.add(request_id)
+                    else:
+                        write_log(f"Batch {batch_number}: Received status 202 but no requestId in response", "red")
+                        with counts_lock:
+                            counts["failed"] += link_count
+                else:
+                    write_log(f"Batch {batch_number} upload failed: {status_code} - {response.text}", "red")
+                    with counts_lock:
+                        counts["failed"] += link_count
+            progress.update(len(batch))
+        
+        # Step 1: Upload all batches, max_in_flight at a time
+        write_log(f"Step 1: Uploading links in batches of up to {upload_size.size}, {max_in_flight} at a time", "cyan")
+        batch_number = 0
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            while True:
+                if len(pending_links) < upload_size.size:
+                    try:
+                        pending_links.extend(itertools.islice(links_iter, upload_size.size - len(pending_links)))
+                    except Exception as e:
+                        # Upload what was read so far and still check the status of the uploaded batches
+                        write_log(f"Error getting links: {str(e)}", "red")
+                        source_failed = True
+                if not pending_links:
+                    break
+                batch = pending_links[:upload_size.size]
+                del pending_links[:len(batch)]
+                batch_number += 1
+                counts["total"] += len(batch)
+                
+                # Log batch info
+                write_log(f"Uploading batch {batch_number} ({len(batch)} links)", "cyan")
+                in_flight.acquire()
+                executor.submit(upload_batch, batch_number, batch)
+        
+        progress.close()
+        upload_size.report()
+        report_wire_bytes(store)
+        
+        # Step 2: Wait for the status of the requests still being processed
+        if pending_requests:
+            write_log(f"\nStep 2: Waiting for the status of {len(pending_requests)} pending requests", "cyan")
+        poller.wait()
+        
         # Final summary of all errors across all batches
         if all_errors:
             write_log("\n--- Error Summary ---", "yellow")
@@ -264,12 +446,12 @@ def upload_links(store, auth_token, links_data, batch_size=20000):
                     else:
                         write_log(f"Error {error_type}: {len(items)}", "red")
         
-        write_log(f"Upload summary: {successful_uploads} successful, {failed_uploads} failed Out of {total_links} total links", "cyan")
-        return failed_uploads == 0, successful_uploads, failed_uploads
+        write_log(f"Upload summary: {counts['successful']} successful, {counts['failed']} failed Out of {counts['total']} total links", "cyan")
+        return counts["failed"] == 0 and not source_failed, counts["successful"], counts["failed"]
     
     except Exception as e:
         write_log(f"Error uploading links: {str(e)}", "red")
-        return False, 0, total_links
+        return False, counts["successful"], counts["failed"] + len(pending_links)
 
 def clean_link_data(link):
     """
@@ -287,39 +469,101 @@ def clean_link_data(link):
     
     return clean_link
 
-def migrate_links(store1, store2, auth_token1, auth_token2):
+def link_signature(label):
+    """Compact digest of what a label links: its model and its links, independent of their order"""
+    links = sorted(
+        (link.get("displayPosition") or 0, str(link.get("itemId")), str(link.get("linkedItemId")), str(link.get("facings")))
+        for link in label.get("links") or []
+    )
+    return hashlib.blake2b(json.dumps([label.get("modelName"), links]).encode(), digest_size=8).digest()
+
+def get_link_signatures(store, auth_token, model_names=None, read_workers=4):
+    """
+    Read the labels of the store and return a barcode -> link signature map,
+    keeping only an 8 byte digest per label instead of the labels themselves
+    """
+    if read_workers > 1 or model_names:
+        link_pages = iter_sharded_link_pages(store, auth_token, model_names, read_workers)
+    else:
+        link_pages = iter_link_pages(store, auth_token)
+    signatures = {}
+    for page in link_pages:
+        for label in page:
+            signatures[label.get("barcode")] = link_signature(label)
+    write_log(f"Indexed the links of {len(signatures)} labels on {store}", "green")
+    return signatures
+
+def changed_links(labels, target_signatures, counts):
+    """
+    Yield the labels that are missing on the target or link something else.
+    Matched barcodes are removed from target_signatures, leaving the labels only found on the target.
+    counts["unchanged"] is increased for every label skipped.
+    """
+    for label in labels:
+        if target_signatures.pop(label.get("barcode"), None) == link_signature(label):
+            counts["unchanged"] += 1
+        else:
+            yield label
+
+def migrate_links(store1, store2, auth_token1, auth_token2, compress=None, max_in_flight=4, validate=True, quarantine_path="quarantine_links.jsonl", model_names=None, read_workers=4, delta=False):
     """
     Migrate links from store1 to store2
+    Links are read in one shard per label model with read_workers workers, model_names
+    limits the migration to the models whose name starts with one of the given names.
+    compress ("gzip" or "zstd") compresses the upload request bodies.
+    max_in_flight is the number of link batches uploaded to store2 at the same time.
+    With delta, the labels of store2 are read first and only the labels that are missing
+    or link different items are uploaded.
+    With validate, labels linking items or link departments that store2 does not have
+    are written to quarantine_path instead of being uploaded.
     """
     write_log(f"\n--- Starting links migration from {store1} to {store2} ---", "yellow")
     
-    # Get links from source store
-    links_data = get_links(store1, auth_token1)
+    # Links are fetched, cleaned and uploaded page by page, without holding the whole store in memory
+    if read_workers > 1 or model_names:
+        link_pages = iter_sharded_link_pages(store1, auth_token1, model_names, read_workers)
+    else:
+        link_pages = iter_link_pages(store1, auth_token1)
+    cleaned_links = (clean_link_data(link) for page in link_pages for link in page)
     
-    if not links_data:
-        write_log("No links found or error fetching links", "red")
-        return False
+    if delta:
+        try:
+            target_signatures = get_link_signatures(store2, auth_token2, model_names, read_workers)
+        except Exception as e:
+            write_log(f"Error reading the links of {store2}: {str(e)}", "red")
+            return False
+        delta_counts = {"unchanged": 0}
+        cleaned_links = changed_links(cleaned_links, target_signatures, delta_counts)
     
-    # Count the links
-    total_links = len(links_data)
-    write_log(f"Found {total_links} links to migrate", "green")
+    if validate:
+        validator = LinkValidator(store2, auth_token2)
+        validator.load()
+        quarantine = QuarantineFile(store1, store2, quarantine_path, kind="labels", key="barcode")
+        cleaned_links = validator.filter(cleaned_links, quarantine)
     
-    if total_links == 0:
-        write_log("No links to migrate", "yellow")
-        return False
+    upload_result, successful_uploads, failed_uploads = upload_links(store2, auth_token2, cleaned_links, compress=compress, max_in_flight=max_in_flight)
+    
+    if delta:
+        write_log(f"Skipped {delta_counts['unchanged']} labels already linked the same way on {store2}", "cyan")
+        if target_signatures:
+            write_log(f"{len(target_signatures)} labels linked on {store2} were not found on {store1} and were left as they are", "yellow")
     
-    # Clean links data - remove unwanted properties
-    write_log("Cleaning link data for migration...", "cyan")
-    cleaned_links = []
-    for link in tqdm(links_data, desc="Processing links"):
-        cleaned_links.append(clean_link_data(link))
+    if validate and quarantine.count:
+        validator.report()
+        quarantine.report()
+        failed_uploads += quarantine.count
+        upload_result = False
     
-    # Upload links to target store
-    write_log(f"Uploading {len(cleaned_links)} links to {store2}...", "cyan")
-    upload_result, successful_uploads, failed_uploads = upload_links(store2, auth_token2, cleaned_links)
+    if delta and successful_uploads == 0 and failed_uploads == 0 and delta_counts["unchanged"]:
+        write_log("All links are already up to date", "green")
+        return True
+    
+    if successful_uploads == 0 and failed_uploads == 0:
+        write_log("No links found or error fetching links", "red")
+        return False
     
     if upload_result:
-        write_log(f"Successfully migrated: {total_links}", "green")
+        write_log(f"Successfully migrated: {successful_uploads}", "green")
         return True
     else:
         # Check if we had at least one successful upload but not complete success
@@ -321,6 +321,7 @@ def check_domain_and_store_availability(domain1, domain2, store1, store2):
 def get_migration_feature(api_compatibility=None):
     print("\n------- Generic configuration ------")
     print("0. Fonts" + (" - API not available" if api_compatibility and not api_compatibility.get("fonts", True) else ""))
+    print("    a. To several target stores" + (" - API not available" if api_compatibility and not api_compatibility.get("fonts", True) else ""))
     print("1. Item properties" + (" - API not available" if api_compatibility and not api_compatibility.get("item_properties", True) else ""))
     print("2. Images (Files)" + (" - API not available" if api_compatibility and not api_compatibility.get("images", True) else ""))
     print("3. Global parameter" + (" - API not available" if api_compatibility and not api_compatibility.get("global_parameters", True) else ""))
@@ -335,7 +336,9 @@ def get_migration_feature(api_compatibility=None):
     print("10. Infra + Trx position" + (" - API not available" if api_compatibility and not api_compatibility.get("infrastructure", True) else ""))
     print("11. Items" + (" - API not available" if api_compatibility and not api_compatibility.get("items", True) else ""))
     print("    a. Only linked label" + (" - API not available" if api_compatibility and not api_compatibility.get("items", True) else ""))
+    print("    b. Only new or changed items" + (" - API not available" if api_compatibility and not api_compatibility.get("items", True) else ""))
     print("12. Links" + (" - API not available" if api_compatibility and not api_compatibility.get("links", True) else ""))
+    print("    a. Only missing or changed links" + (" - API not available" if api_compatibility and not api_compatibility.get("links", True) else ""))
     print("\n------- Extra ----------------------")
     print("r. Return to main menu")
     print("\nTip: You can run multiple features by:")
@@ -716,11 +719,12 @@ def main():
                     
                     # Skip features that aren't compatible with this onprem version
                     feature_api_map = {
-                        "0": "fonts", "1": "item_properties", "2": "images",
+                        "0": "fonts", "0a": "fonts", "0.a": "fonts", "1": "item_properties", "2": "images",
                         "3": "global_parameters", "4": "templates", "5": "webhooks",
                         "6": "system_parameters", "7": "general_settings", "8": "jobs",
                         "9": "geoloc", "10": "infrastructure", "11": "items", 
-                        "11a": "items", "11.a": "items", "12": "links"
+                        "11a": "items", "11.a": "items", "11b": "items", "11.b": "items", "12": "links",
+                        "12a": "links", "12.a": "links"
                     }
                     
                     if feature in feature_api_map and not api_compatibility.get(feature_api_map[feature], False):
@@ -729,6 +733,10 @@ def main():
                     
                     if feature == "0":
                         fonts.migrate_fonts(store1, store2, auth_header1, auth_token2, None, STORE_DATA['domain2'])
+                    elif feature == "0a" or feature == "0.a":
+                        store_ids = input(f"Target store IDs in {store2.split('.')[1]} (comma separated, e.g. 6101,6102): ").split(",")
+                        targets = [(f"{store_id.strip()}.{store2.split('.')[1]}", auth_token2, STORE_DATA['domain2']) for store_id in store_ids if store_id.strip()]
+                        fonts.fan_out_fonts(store1, auth_header1, None, targets)
                     elif feature == "1":
                         item_properties.migrate_item_properties(store1, store2, auth_header1, auth_token2)
                     elif feature == "2":
@@ -750,15 +758,19 @@ def main():
                     elif feature == "10":
                         infrastructure.migrate_infrastructure(store1, store2, auth_header1, auth_token2, STORE_DATA.get('domain2'))
                     elif feature == "11":
-                        items.migrate_items(store1, store2, auth_header1, auth_token2)
+                        items.migrate_items(store1, store2, auth_header1, auth_token2, passthrough=True, compress="gzip")
                     elif feature == "11a" or feature == "11.a":
                         if not store1 or not store2 or not auth_header1 or not auth_token2:
                             write_log("Please set source and target stores and authenticate first!", "red")
                         else:
                             write_log(f"Migrating linked items from {store1} to {store2}...", "cyan")
-                            migrate_linked_items(store1, store2, auth_header1, auth_token2)
-                    elif feature == "12":
-                        links.migrate_links(store1, store2, auth_header1, auth_token2)
+                            migrate_linked_items(store1, store2, auth_header1, auth_token2, compress="gzip")
+                    elif feature == "11b" or feature == "11.b":
+                        verify_index = input(f"Verify the local item index against a fresh read of {store2}? (y/n): ").lower() == 'y'
+                        items.migrate_items(store1, store2, auth_header1, auth_token2, delta=True, verify_index=verify_index, compress="gzip")
+                    elif feature in ["12", "12a", "12.a"]:
+                        model_names = [name.strip() for name in input("Label models to migrate (comma separated names or name prefixes, empty for all): ").split(",") if name.strip()]
+                        links.migrate_links(store1, store2, auth_header1, auth_token2, compress="gzip", model_names=model_names, delta=feature != "12")
         else:  # Plaza to Plaza (original logic)
             store1 = input("Enter source store1_ID.domain1 (e.g. 1017.plus): ")
             store2 = input("Enter target store2_ID.domain2 (e.g. 6101.plus-v2): ")
@@ -841,6 +853,10 @@ def main():
                     feature = feature.strip()
                     if feature == "0":
                         fonts.migrate_fonts(store1, store2, auth_token1, auth_token2, STORE_DATA['domain1'], STORE_DATA['domain2'])
+                    elif feature == "0a" or feature == "0.a":
+                        store_ids = input(f"Target store IDs in {store2.split('.')[1]} (comma separated, e.g. 6101,6102): ").split(",")
+                        targets = [(f"{store_id.strip()}.{store2.split('.')[1]}", auth_token2, STORE_DATA['domain2']) for store_id in store_ids if store_id.strip()]
+                        fonts.fan_out_fonts(store1, auth_token1, STORE_DATA['domain1'], targets)
                     elif feature == "1":
                         item_properties.migrate_item_properties(store1, store2, auth_token1, auth_token2)
                     elif feature == "2":
@@ -862,15 +878,19 @@ def main():
                     elif feature == "10":
                         infrastructure.migrate_infrastructure(store1, store2, auth_token1, auth_token2, STORE_DATA['domain2'])
                     elif feature == "11":
-                        items.migrate_items(store1, store2, auth_token1, auth_token2)
+                        items.migrate_items(store1, store2, auth_token1, auth_token2, passthrough=True)
                     elif feature == "11a" or feature == "11.a":
                         if not store1 or not store2 or not auth_token1 or not auth_token2:
                             write_log("Please set source and target stores and authenticate first!", "red")
                         else:
                             write_log(f"Migrating linked items from {store1} to {store2}...", "cyan")
                             migrate_linked_items(store1, store2, auth_token1, auth_token2)
-                    elif feature == "12":
-                        links.migrate_links(store1, store2, auth_token1, auth_token2)
+                    elif feature == "11b" or feature == "11.b":
+                        verify_index = input(f"Verify the local item index against a fresh read of {store2}? (y/n): ").lower() == 'y'
+                        items.migrate_items(store1, store2, auth_token1, auth_token2, delta=True, verify_index=verify_index)
+                    elif feature in ["12", "12a", "12.a"]:
+                        model_names = [name.strip() for name in input("Label models to migrate (comma separated names or name prefixes, empty for all): ").split(",") if name.strip()]
+                        links.migrate_links(store1, store2, auth_token1, auth_token2, model_names=model_names, delta=feature != "12")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+from common import write_log
+import json
+import os
+import threading
+import time
+
+class MigrationJournal:
+    """
+    Durable record of a batch migration between two stores: the source offset up to which
+    batches were accepted by the target, and the request IDs the target is still processing.
+    Saved after every change, so an interrupted migration can resume where it stopped.
+    Entries that were not updated for max_age seconds are considered stale and ignored.
+    """
+    def __init__(self, kind, store1, store2, path="migration_journal.json", max_age=24 * 3600):
+        self.key = f"{kind}:{store1}->{store2}"
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as journal_file:
+                    self.entries = json.load(journal_file)
+            except Exception as e:
+                write_log(f"Could not read migration journal {path}, starting a new one: {str(e)}", "yellow")
+        entry = self.entries.get(self.key)
+        if entry and time.time() - entry.get("updated_at", 0) > max_age:
+            write_log(f"Ignoring stale migration journal entry for {self.key}, starting from the beginning", "yellow")
+            del self.entries[self.key]
+        self.entry = self.entries.setdefault(self.key, {"next_start": 0, "outstanding": []})
+
+    @property
+    def next_start(self):
+        return self.entry["next_start"]
+
+    @property
+    def outstanding(self):
+        return list(self.entry["outstanding"])
+
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a truncated journal
+        if self.key in self.entries:
+            self.entry["updated_at"] = time.time()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as journal_file:
+            json.dump(self.entries, journal_file)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def record_batch(self, next_start, request_ids):
+        """Record that every batch before next_start was accepted, with the request IDs to follow up"""
+        with self.lock:
+            self.entry["next_start"] = next_start
+            self.entry["outstanding"].extend(request_ids)
+            self.save()
+
+    def record_request(self, request_id):
+        """Record a request that does not move the source offset, such as a re-submission"""
+        with self.lock:
+            self.entry["outstanding"].append(request_id)
+            self.save()
+
+    def record_completed(self, request_id):
+        """Record that a request needs no more follow-up, because it finished, timed out or is unknown to the target"""
+        with self.lock:
+            if request_id in self.entry["outstanding"]:
+                self.entry["outstanding"].remove(request_id)
+                self.save()
+
+    def finish(self):
+        """Forget this migration once it has fully completed"""
+        with self.lock:
+            self.entries.pop(self.key, None)
+            self.save()
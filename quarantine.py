@@ -0,0 +1,37 @@
+from common import write_log
+from datetime import datetime
+import json
+import threading
+
+class QuarantineFile:
+    """
+    Records the items a target store refused, one JSON line per item, so the rest of
+    the migration can go through and the bad records can be fixed and re-sent later.
+    kind and key name the records and their identifying property, such as "labels" and "barcode".
+    """
+    def __init__(self, store1, store2, path="quarantine_items.jsonl", kind="items", key="itemId"):
+        self.store1 = store1
+        self.store2 = store2
+        self.path = path
+        self.kind = kind
+        self.key = key
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, item, reason):
+        with self.lock:
+            with open(self.path, "a") as quarantine_file:
+                quarantine_file.write(json.dumps({
+                    "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "source": self.store1,
+                    "target": self.store2,
+                    self.key: item.get(self.key),
+                    "reason": reason,
+                    "item": item
+                }) + "\n")
+            self.count += 1
+        write_log(f"Quarantined {self.key} {item.get(self.key)}: {reason}", "red")
+
+    def report(self):
+        if self.count:
+            write_log(f"{self.count} {self.kind} refused by {self.store2} were written to {self.path}", "yellow")
@@ -0,0 +1,137 @@
+from common import write_log
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import threading
+import time
+
+class RequestPoller:
+    """
+    Poll the status of many asynchronous requests (items-result, labels-result) at the same time.
+    Each request ID gets its own adaptive backoff and is dropped as soon as it finishes.
+
+    check_func(request_id) must return a tuple (finished, result).
+    on_complete(request_id, result) is called once per request, with result None on timeout
+    or when the status request is refused with a 4xx response (unknown request ID, expired token).
+    Other errors are treated as transient and the request is checked again later.
+    on_complete runs on the polling thread, so it should not block.
+    """
+    def __init__(self, check_func, on_complete=None, initial_delay=2, max_delay=30, backoff=1.5, timeout=1800, max_workers=8):
+        self.check_func = check_func
+        self.on_complete = on_complete
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.pending = {}  # request_id -> {"next_check", "delay", "deadline"}
+        self.results = {}
+        self.completing = 0  # Requests whose on_complete is running
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = None
+
+    def add(self, request_id):
+        """Start tracking a request ID"""
+        with self.condition:
+            now = time.monotonic()
+            self.pending[request_id] = {
+                "next_check": now + self.initial_delay,
+                "delay": self.initial_delay,
+                "deadline": now + self.timeout
+            }
+            self.condition.notify_all()
+
+    def start(self):
+        """Start polling in the background, request IDs can still be added afterwards"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def wait_idle(self):
+        """Wait until every tracked request has finished and been handled, more can be added afterwards"""
+        self.start()
+        with self.condition:
+            while self.pending or self.completing:
+                self.condition.wait()
+
+    def wait_for_room(self, max_pending):
+        """Wait until fewer than max_pending requests are tracked"""
+        self.start()
+        with self.condition:
+            while len(self.pending) + self.completing >= max_pending:
+                self.condition.wait()
+
+    def wait(self):
+        """Wait until every tracked request has finished or timed out and return the results by request ID"""
+        self.start()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        return self.results
+
+    def check(self, request_id):
+        try:
+            return self.check_func(request_id)
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                # Asking again will not change the answer, give up on this request
+                write_log(f"Status of request ID {request_id} refused with status {status_code}, giving up: {str(e)}", "red")
+                return True, None
+            write_log(f"Error checking status for request ID {request_id}: {str(e)}", "red")
+            return False, None
+        except Exception as e:
+            write_log(f"Error checking status for request ID {request_id}: {str(e)}", "red")
+            return False, None
+
+    def next_due(self):
+        """Block until at least one request is due for a check, return None once everything is done"""
+        with self.condition:
+            while True:
+                if not self.pending and self.closed:
+                    return None
+                now = time.monotonic()
+                due = [request_id for request_id, state in self.pending.items() if state["next_check"] <= now]
+                if due:
+                    return due
+                if self.pending:
+                    wait_time = min(state["next_check"] for state in self.pending.values()) - now
+                    self.condition.wait(timeout=wait_time)
+                else:
+                    self.condition.wait()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                due = self.next_due()
+                if due is None:
+                    return
+
+                checks = {request_id: executor.submit(self.check, request_id) for request_id in due}
+                for request_id, future in checks.items():
+                    finished, result = future.result()
+                    now = time.monotonic()
+
+                    with self.condition:
+                        state = self.pending[request_id]
+                        if not finished and now < state["deadline"]:
+                            # Still running, back off before the next check of this request
+                            state["delay"] = min(state["delay"] * self.backoff, self.max_delay)
+                            state["next_check"] = now + state["delay"]
+                            continue
+                        del self.pending[request_id]
+                        self.completing += 1
+
+                    if not finished:
+                        write_log(f"Request {request_id} still in progress after {self.timeout} seconds, giving up", "red")
+                    self.results[request_id] = result
+                    try:
+                        if self.on_complete:
+                            self.on_complete(request_id, result)
+                    except Exception as e:
+                        write_log(f"Error handling the result of request ID {request_id}: {str(e)}", "red")
+                    finally:
+                        with self.condition:
+                            self.completing -= 1
+                            self.condition.notify_all()
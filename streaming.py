@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import uuid
+
+class MultipartStream:
+    """
+    multipart/form-data request body that reads file parts from disk in small chunks while
+    the request is being sent, instead of building the whole body in memory.
+    fields is a list of (name, (filename, local_path, content_type)) tuples, the same shape
+    as the files argument of requests. Send it with data=stream and
+    headers={"Content-Type": stream.content_type}.
+    """
+    def __init__(self, fields, chunk_size=64 * 1024):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.chunk_size = chunk_size
+        self.parts = []  # bytes, or a str path for file content
+        for name, (filename, local_path, content_type) in fields:
+            filename = filename.replace('"', "%22")
+            self.parts.append((
+                f"--{self.boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: {content_type}\r\n\r\n"
+            ).encode())
+            self.parts.append(local_path)
+            self.parts.append(b"\r\n")
+        self.parts.append(f"--{self.boundary}--\r\n".encode())
+        self.length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self.parts)
+        self.part_index = 0
+        self.offset = 0  # Position in the current bytes part
+        self.current_file = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        chunks = []
+        while size > 0 and self.part_index < len(self.parts):
+            part = self.parts[self.part_index]
+            if isinstance(part, bytes):
+                chunk = part[self.offset:self.offset + size]
+                self.offset += len(chunk)
+            else:
+                if self.current_file is None:
+                    self.current_file = open(part, "rb")
+                chunk = self.current_file.read(min(size, self.chunk_size))
+
+            if chunk:
+                chunks.append(chunk)
+                size -= len(chunk)
+            else:
+                # Current part is done, move on to the next one
+                if self.current_file is not None:
+                    self.current_file.close()
+                    self.current_file = None
+                self.part_index += 1
+                self.offset = 0
+        return b"".join(chunks)
+
+    def close(self):
+        if self.current_file is not None:
+            self.current_file.close()
+            self.current_file = None
+
+def post_multipart(post, url, headers, fields, **kwargs):
+    """POST fields as a streamed multipart body with post (requests.post or a session's post)"""
+    stream = MultipartStream(fields)
+    try:
+        return post(url, headers={**headers, "Content-Type": stream.content_type}, data=stream, **kwargs)
+    finally:
+        stream.close()
+
+def stream_download(get, url, chunk_size=64 * 1024, **kwargs):
+    """
+    Return a download_to(file) function for BlobCache.fetch_path that GETs url with get
+    (requests.get or a session's get) and writes the response body to file in chunks
+    """
+    def download_to(file):
+        with get(url, stream=True, **kwargs) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
+    return download_to
+
+def iter_from_threads(producers, max_in_flight, workers=None):
+    """
+    Run each producer(put) on a background thread and yield what the producers put, as it arrives.
+    put(entry) blocks while max_in_flight entries are waiting and returns False once the consumer
+    has stopped, the producer should return then. An exception raised by a producer is raised here.
+    At most workers producers run at the same time, all of them by default.
+    """
+    entries = queue.Queue(maxsize=max_in_flight)
+    stop_event = threading.Event()
+    end_of_producer = object()
+    
+    def put(entry):
+        # Block while the queue is full, but give up if the consumer has stopped
+        while not stop_event.is_set():
+            try:
+                entries.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def run(producer):
+        try:
+            producer(put)
+        except Exception as e:
+            put(e)
+        finally:
+            put(end_of_producer)
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, workers or len(producers)))
+    try:
+        for producer in producers:
+            executor.submit(run, producer)
+        
+        remaining = len(producers)
+        while remaining:
+            entry = entries.get()
+            if entry is end_of_producer:
+                remaining -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        # Release the producers if the consumer stopped early
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)